@@ -0,0 +1,123 @@
+"""Exercise catalog search.
+
+Names and aliases are indexed by word prefix for typeahead; a query with no
+prefix match falls back to trigram similarity, which absorbs typos.
+"""
+
+import heapq
+import re
+from typing import List, Optional
+
+from pydantic import BaseModel, TypeAdapter
+
+MIN_TRIGRAM_SIMILARITY = 0.2
+
+class CatalogExercise(BaseModel):
+    name: str
+    category: str
+    equipment: Optional[str] = None
+    muscles: List[str] = []
+    aliases: List[str] = []
+
+def normalize_term(text):
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+def trigrams(term):
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class ExerciseCatalog:
+    def __init__(self, exercises):
+        self.exercises = tuple(e.model_dump() for e in exercises)
+        names = [e['name'] for e in self.exercises]
+        if len(set(names)) != len(names):
+            raise ValueError("Exercise catalog has duplicate names")
+        self.categories = sorted({e['category'] for e in self.exercises})
+        # Tie-break between equally good matches: shorter names first
+        order = sorted(range(len(names)), key=lambda i: (len(names[i]), names[i]))
+        self.order = {i: pos for pos, i in enumerate(order)}
+        self.terms = []  # per exercise: normalized name, then aliases
+        self.term_grams = []
+        self.prefixes = {}
+        self.name_prefixes = {}
+        self.trigrams = {}
+        self.filters = {'category': {}, 'equipment': {}, 'muscle': {}}
+        for i, e in enumerate(self.exercises):
+            terms = [normalize_term(t) for t in (e['name'], *e['aliases'])]
+            self.terms.append(terms)
+            self.term_grams.append([len(trigrams(t)) for t in terms])
+            for n in range(1, len(terms[0]) + 1):
+                self.name_prefixes.setdefault(terms[0][:n], set()).add(i)
+            for k, term in enumerate(terms):
+                for word in term.split():
+                    for n in range(1, len(word) + 1):
+                        self.prefixes.setdefault(word[:n], set()).add(i)
+                for gram in trigrams(term):
+                    self.trigrams.setdefault(gram, []).append((i, k))
+            values = {'category': [e['category']], 'equipment': [e['equipment'] or ''], 'muscle': e['muscles']}
+            for field, vals in values.items():
+                for value in vals:
+                    self.filters[field].setdefault(value.lower(), set()).add(i)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls(TypeAdapter(List[CatalogExercise]).validate_json(f.read()))
+
+    def filtered(self, filters):
+        allowed = None
+        for field, value in filters.items():
+            if value:
+                ids = self.filters[field].get(value.lower(), set())
+                allowed = ids if allowed is None else allowed & ids
+        return allowed
+
+    def search(self, query='', limit=20, **filters):
+        allowed = self.filtered(filters)
+        q = normalize_term(query)
+        if not q:
+            ids = range(len(self.exercises)) if allowed is None else allowed
+            return [self.exercises[i] for i in heapq.nsmallest(limit, ids, key=lambda i: self.exercises[i]['name'])]
+
+        # Every query word has to prefix a word of the exercise's name or aliases
+        candidates = set.intersection(*(self.prefixes.get(w, set()) for w in q.split()))
+        if allowed is not None:
+            candidates &= allowed
+        if candidates:
+            # Whole-name prefix matches are ranked on their own first, so a short
+            # query rarely has to rank the whole candidate set
+            leading = candidates & self.name_prefixes.get(q, set())
+            ranked = heapq.nsmallest(
+                limit, leading, key=lambda i: (self.terms[i][0] != q, self.order[i])
+            )
+            if len(ranked) < limit:
+                words = q.split()
+
+                def rank(i):
+                    terms = self.terms[i]
+                    if q in terms:
+                        tier = 0
+                    elif all(any(w.startswith(p) for w in terms[0].split()) for p in words):
+                        tier = 1
+                    elif any(t.startswith(q) for t in terms):
+                        tier = 2
+                    else:
+                        tier = 3
+                    return tier, self.order[i]
+                ranked += heapq.nsmallest(limit - len(ranked), candidates - leading, key=rank)
+            return [self.exercises[i] for i in ranked]
+
+        grams = trigrams(q)
+        shared = {}
+        for gram in grams:
+            for key in self.trigrams.get(gram, ()):
+                shared[key] = shared.get(key, 0) + 1
+        similarity = {}
+        for (i, k), count in shared.items():
+            if allowed is not None and i not in allowed:
+                continue
+            score = count / (len(grams) + self.term_grams[i][k] - count)
+            if score >= MIN_TRIGRAM_SIMILARITY and score > similarity.get(i, 0):
+                similarity[i] = score
+        best = heapq.nsmallest(limit, similarity, key=lambda i: (-similarity[i], self.order[i]))
+        return [self.exercises[i] for i in best]
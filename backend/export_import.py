@@ -0,0 +1,222 @@
+"""Workout history export and import formats: CSV, NDJSON and Parquet.
+
+A workout is flattened to one row per set (workout -> exercise -> set);
+workouts without exercises and exercises without sets get a row with the
+lower levels left empty. Encoders take async chunks of rows and yield bytes;
+decoders read a request body as it streams in and yield
+(row_number, row, error). Reading from and writing to MongoDB is left to
+server.py.
+"""
+
+import codecs
+import csv
+import io
+import tempfile
+from datetime import datetime
+
+import orjson
+from fastapi import HTTPException
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export/import is unavailable
+    pa = pq = None
+
+EXPORT_COLUMNS = (
+    'workout_id', 'date', 'duration', 'notes', 'created_at',
+    'exercise_index', 'exercise', 'category', 'set_index', 'reps', 'weight', 'completed'
+)
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_MEDIA_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet'
+}
+# Parquet keeps its metadata at the end of the file, so an upload is spooled
+# (to disk past this size) before it is read back a row group at a time
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
+def parquet_schema():
+    return pa.schema([
+        ('workout_id', pa.string()), ('date', pa.string()), ('duration', pa.int64()),
+        ('notes', pa.string()), ('created_at', pa.string()), ('exercise_index', pa.int32()),
+        ('exercise', pa.string()), ('category', pa.string()), ('set_index', pa.int32()),
+        ('reps', pa.int64()), ('weight', pa.float64()), ('completed', pa.bool_())
+    ])
+
+def require_parquet(format):
+    if format == 'parquet' and pq is None:
+        raise HTTPException(status_code=501, detail="Parquet support requires pyarrow")
+
+def workout_rows(workout):
+    base = {
+        'workout_id': str(workout['_id']), 'date': workout['date'], 'duration': workout.get('duration'),
+        'notes': workout.get('notes'), 'created_at': workout.get('created_at')
+    }
+    empty = dict.fromkeys(EXPORT_COLUMNS[5:])
+    if not workout.get('exercises'):
+        yield {**base, **empty}
+    for i, exercise in enumerate(workout.get('exercises', [])):
+        parent = {**base, **empty, 'exercise_index': i, 'exercise': exercise['name'], 'category': exercise['category']}
+        if not exercise.get('sets'):
+            yield parent
+        for j, s in enumerate(exercise.get('sets', [])):
+            yield {**parent, 'set_index': j, 'reps': s['reps'], 'weight': s['weight'], 'completed': s['completed']}
+
+async def encode_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_COLUMNS)
+    writer.writeheader()
+    async for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()  # header only: nothing to export
+
+async def encode_ndjson(chunks):
+    async for chunk in chunks:
+        yield b''.join(orjson.dumps(row) + b'\n' for row in chunk)
+
+class DrainableSink:
+    # Write-only file for ParquetWriter that hands over what was written since
+    # the last drain(); tell() keeps counting so the footer offsets stay right
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+async def encode_parquet(chunks):
+    # One row group per chunk
+    schema = parquet_schema()
+    sink = DrainableSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    async for chunk in chunks:
+        writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+def split_csv_records(text):
+    # Splits off the complete records: up to the last newline outside quotes
+    cut = start = quotes = 0
+    while True:
+        newline = text.find('\n', start)
+        if newline < 0:
+            return text[:cut], text[cut:]
+        quotes += text.count('"', start, newline)
+        start = newline + 1
+        if quotes % 2 == 0:
+            cut = start
+
+async def decode_csv(request):
+    # Yields (row_number, row, error); empty fields come back as None
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    stream = request.stream()
+    pending, header, row_number = '', None, 0
+    while True:
+        data = await anext(stream, None)
+        text = pending + decoder.decode(data or b'', final=data is None)
+        # The last record need not end in a newline
+        complete, pending = split_csv_records(text if data is not None else text + '\n')
+        for values in csv.reader(io.StringIO(complete, newline='')):
+            if not values:
+                continue
+            if header is None:
+                header = [v.strip() for v in values]
+                continue
+            row_number += 1
+            yield row_number, {k: v if v != '' else None for k, v in zip(header, values)}, None
+        if data is None:
+            break
+    if pending.strip():
+        yield row_number + 1, None, "Unterminated quoted field"
+
+async def decode_ndjson(request):
+    stream = request.stream()
+    pending, row_number = b'', 0
+    while True:
+        data = await anext(stream, None)
+        lines = (pending + (data or b'')).split(b'\n')
+        pending = lines.pop() if data is not None else b''
+        for line in lines:
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                row = orjson.loads(line)
+            except ValueError:
+                yield row_number, None, "Invalid JSON"
+                continue
+            if not isinstance(row, dict):
+                yield row_number, None, "Expected a JSON object"
+                continue
+            yield row_number, row, None
+        if data is None:
+            break
+
+async def decode_parquet(request):
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as spool:
+        async for data in request.stream():
+            spool.write(data)
+        spool.seek(0)
+        try:
+            parquet_file = pq.ParquetFile(spool)
+        except (pa.ArrowException, OSError):
+            raise HTTPException(status_code=400, detail="Invalid Parquet file")
+        row_number = 0
+        for batch in parquet_file.iter_batches(batch_size=EXPORT_CHUNK_ROWS):
+            for row in batch.to_pylist():
+                row_number += 1
+                yield row_number, row, None
+
+IMPORT_DECODERS = {'csv': decode_csv, 'ndjson': decode_ndjson, 'parquet': decode_parquet}
+
+def workout_from_rows(rows):
+    # The workout dict for one group of rows, in the POST /workouts shape
+    first = rows[0]
+    workout = {k: first.get(k) for k in ('date', 'duration', 'notes') if first.get(k) is not None}
+    workout['exercises'] = []
+    exercises = {}
+    for row in rows:
+        if row.get('exercise') is None:
+            continue
+        key = row['exercise'] if row.get('exercise_index') is None else row['exercise_index']
+        if key not in exercises:
+            exercises[key] = {'name': row['exercise'], 'category': row.get('category'), 'sets': []}
+            workout['exercises'].append(exercises[key])
+        if row.get('reps') is not None or row.get('weight') is not None:
+            exercises[key]['sets'].append(
+                {k: row[k] for k in ('reps', 'weight', 'completed') if row.get(k) is not None}
+            )
+    return workout
+
+def imported_created_at(value, default):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value:
+        datetime.fromisoformat(value)
+        return value
+    return default
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Online migration of the workouts collection to storage format v2.
+
+Documents are rewritten in batches with a conditional replace (only while they
+are still v1), so the API can keep serving and writing during the migration.
+Reports the BSON size of the migrated documents before and after.
+
+    python migrate_workouts.py [--batch-size 500] [--pause 0.1] [--dry-run]
+"""
+
+import argparse
+import asyncio
+
+import bson
+from pymongo import ReplaceOne
+
+import server
+from server import MAX_SETS_PER_EXERCISE, WORKOUT_FORMAT, encodable, encode_workout
+
+
+async def migrate(batch_size, pause, dry_run):
+    stats = {'migrated': 0, 'skipped': 0, 'bytes_before': 0, 'bytes_after': 0}
+    batch = []
+
+    async def flush():
+        if batch and not dry_run:
+            await server.db.workouts.bulk_write(batch, ordered=False)
+        batch.clear()
+        if pause:
+            await asyncio.sleep(pause)
+
+    async for doc in server.db.workouts.find({'v': {'$ne': WORKOUT_FORMAT}}):
+        if not encodable(doc):
+            stats['skipped'] += 1
+            continue
+        encoded = encode_workout(doc)
+        stats['migrated'] += 1
+        stats['bytes_before'] += len(bson.encode(doc))
+        stats['bytes_after'] += len(bson.encode(encoded))
+        batch.append(ReplaceOne({'_id': doc['_id'], 'v': {'$ne': WORKOUT_FORMAT}}, encoded))
+        if len(batch) >= batch_size:
+            await flush()
+    await flush()
+    return stats
+
+
+def print_report(stats, dry_run):
+    migrated = stats['migrated']
+    print(f"{'Would migrate' if dry_run else 'Migrated'} {migrated} workouts"
+          f" ({stats['skipped']} skipped: more than {MAX_SETS_PER_EXERCISE} sets in an exercise)")
+    if migrated:
+        before, after = stats['bytes_before'], stats['bytes_after']
+        print(f"BSON size before: {before} bytes ({before / migrated:.1f} avg)")
+        print(f"BSON size after:  {after} bytes ({after / migrated:.1f} avg)")
+        print(f"Reduction: {100 * (1 - after / before):.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate workouts to storage format v2")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument('--dry-run', action='store_true', help="measure only, do not write")
+    args = parser.parse_args()
+
+    # The app creates its client in the lifespan; this script needs its own
+    server.connect_mongo()
+    try:
+        stats = asyncio.run(migrate(args.batch_size, args.pause, args.dry_run))
+    finally:
+        server.client.close()
+    print_report(stats, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""Prometheus metrics, the MongoDB slow-query log and the request profiler.
+
+server.py wires these into the app: the middlewares, the driver listeners
+passed to the Motor client, and the /metrics and /debug/slow-queries routes.
+"""
+
+import asyncio
+import contextvars
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as Tally, deque
+from datetime import datetime
+
+import orjson
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, disable_created_metrics
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Metrics
+# Prometheus metrics, served at /metrics. Values are per process: with several
+# uvicorn workers each scrape sees the worker that answered it.
+disable_created_metrics()  # *_created series would double the scrape size
+metrics_registry = CollectorRegistry()
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HTTP_REQUESTS = Counter(
+    'http_requests', 'Requests by route template and status', ['method', 'route', 'status'],
+    registry=metrics_registry
+)
+HTTP_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to the last byte of the response', ['method', 'route'],
+    buckets=LATENCY_BUCKETS, registry=metrics_registry
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Response body size', ['method', 'route'],
+    buckets=(100, 1000, 10_000, 100_000, 1_000_000, 10_000_000), registry=metrics_registry
+)
+# By method only: the route is resolved inside the app, after the request starts
+HTTP_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'Requests being handled', ['method'], registry=metrics_registry
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command round trips', ['command', 'collection'],
+    buckets=(0.0005,) + LATENCY_BUCKETS[:-1], registry=metrics_registry
+)
+MONGO_COMMAND_FAILURES = Counter(
+    'mongodb_command_failures', 'MongoDB commands that returned an error', ['command', 'collection'],
+    registry=metrics_registry
+)
+
+def route_name(scope):
+    # Route template, so ids in paths don't each become a label value
+    route = scope.get('route')
+    return route.path if route is not None else 'unmatched'
+
+class RequestMetricsMiddleware:
+    # Plain ASGI so streamed bodies are timed and counted to the last chunk
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        method = scope['method']
+        status, size = 500, 0
+        started = time.perf_counter()
+
+        async def measured_send(message):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        label = request_label.set(f"{method} {scope['path']}")
+        try:
+            await self.app(scope, receive, measured_send)
+        finally:
+            request_label.reset(label)
+            in_flight.dec()
+            route = route_name(scope)
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_RESPONSE_SIZE.labels(method, route).observe(size)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+
+MONGO_SLOW_COMMANDS = Counter(
+    'mongodb_slow_commands', 'MongoDB commands slower than SLOW_QUERY_MS', ['command', 'collection'],
+    registry=metrics_registry
+)
+
+# Slow-query log
+# Commands slower than SLOW_QUERY_MS (0 disables) are logged with their filter
+# and sort and the request that issued them. Reads and writes that can be
+# explained are then re-run through explain (executionStats, which never
+# applies writes), at most once per command shape every
+# SLOW_QUERY_EXPLAIN_INTERVAL seconds, and the winning plan and documents
+# examined vs returned are logged with them. The last entries are kept for
+# GET /debug/slow-queries.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS', 60))
+SLOW_QUERY_LOG_CHARS = 4000
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'findAndModify', 'update', 'delete'}
+# Session, transaction and routing fields the driver adds, which explain rejects
+DRIVER_COMMAND_FIELDS = {'lsid', 'txnNumber', 'autocommit', 'startTransaction', 'writeConcern', 'readConcern'}
+slow_queries = deque(maxlen=100)
+# Set by RequestMetricsMiddleware; Motor carries it onto the driver's threads
+request_label = contextvars.ContextVar('request_label', default=None)
+
+def command_shape(command, body):
+    # What the slow-query log shows of a command: its filter, sort or pipeline
+    if command == 'update':
+        first = body['updates'][0] if body.get('updates') else {}
+        return {'filter': first.get('q'), 'statements': len(body.get('updates', []))}
+    if command == 'delete':
+        first = body['deletes'][0] if body.get('deletes') else {}
+        return {'filter': first.get('q'), 'statements': len(body.get('deletes', []))}
+    if command == 'aggregate':
+        return {'pipeline': body.get('pipeline')}
+    shape = {'filter': body.get('filter', body.get('query'))}
+    if body.get('sort'):
+        shape['sort'] = body['sort']
+    if command == 'distinct':
+        shape['key'] = body.get('key')
+    return shape
+
+def shape_signature(value):
+    # Field names and operators without the values, for rate-limiting explains
+    if isinstance(value, dict):
+        return '{' + ','.join(f'{k}:{shape_signature(v)}' for k, v in value.items()) + '}'
+    if isinstance(value, list):
+        return '[' + ','.join(shape_signature(v) for v in value[:1]) + ']'
+    return '?'
+
+def explain_body(command, body):
+    explained = {
+        k: v for k, v in body.items()
+        if not k.startswith('$') and k not in DRIVER_COMMAND_FIELDS
+    }
+    # explain takes a single write statement
+    for key in ('updates', 'deletes'):
+        if key in explained:
+            explained[key] = explained[key][:1]
+    return explained
+
+def slow_command_json(entry):
+    # Filters can hold any BSON value; anything orjson can't encode is shown as str()
+    return orjson.dumps(entry, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+def log_slow_command(entry):
+    logger.warning(f"Slow MongoDB command: {slow_command_json(entry)[:SLOW_QUERY_LOG_CHARS].decode(errors='replace')}")
+
+def find_key(doc, key):
+    # First nested dict holding `key`; aggregate explains nest the find stage under $cursor
+    if isinstance(doc, dict):
+        if key in doc:
+            return doc[key]
+        values = doc.values()
+    elif isinstance(doc, list):
+        values = doc
+    else:
+        return None
+    for value in values:
+        found = find_key(value, key)
+        if found is not None:
+            return found
+    return None
+
+def explain_summary(explained):
+    stats = find_key(explained, 'executionStats') or {}
+    stages = plan_stages((find_key(explained, 'queryPlanner') or {}).get('winningPlan', {}))
+    return {
+        'stages': stages,
+        'collscan': 'COLLSCAN' in stages,
+        'docs_examined': stats.get('totalDocsExamined'),
+        'keys_examined': stats.get('totalKeysExamined'),
+        'returned': stats.get('nReturned'),
+        'execution_ms': stats.get('executionTimeMillis')
+    }
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    # Called on the driver's threads. started() only remembers what
+    # succeeded()/failed() need, keyed by request_id; slow commands are handed
+    # to the event loop, which is set once it is running, and explained through
+    # the client set by whoever creates it.
+    def __init__(self):
+        self.started_commands = {}
+        self.explained_at = {}
+        self.loop = None
+        self.client = None
+
+    def started(self, event):
+        command = event.command_name
+        target = event.command.get('collection' if command == 'getMore' else command)
+        collection = target if isinstance(target, str) else ''
+        self.started_commands[event.request_id] = (
+            command, collection, event.command if SLOW_QUERY_MS > 0 else None, request_label.get()
+        )
+
+    def finished(self, event):
+        command, collection, body, label = self.started_commands.pop(
+            event.request_id, (event.command_name, '', None, None)
+        )
+        duration = event.duration_micros / 1e6
+        MONGO_COMMAND_LATENCY.labels(command, collection).observe(duration)
+        if body is not None and duration * 1000 >= SLOW_QUERY_MS and command != 'explain':
+            MONGO_SLOW_COMMANDS.labels(command, collection).inc()
+            entry = {
+                'at': datetime.utcnow().isoformat(), 'request': label, 'command': command,
+                'collection': collection, 'duration_ms': round(duration * 1000, 1),
+                **(command_shape(command, body) if command in EXPLAINABLE_COMMANDS else {})
+            }
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.record_slow, entry, body, event.database_name)
+            else:
+                self.record_slow(entry, None, None)
+        return command, collection
+
+    def succeeded(self, event):
+        self.finished(event)
+
+    def failed(self, event):
+        MONGO_COMMAND_FAILURES.labels(*self.finished(event)).inc()
+
+    def record_slow(self, entry, body, database):
+        slow_queries.append(entry)
+        command = entry['command']
+        if body is None or command not in EXPLAINABLE_COMMANDS:
+            log_slow_command(entry)
+            return
+        signature = (command, entry['collection'], shape_signature(command_shape(command, body)))
+        now = time.monotonic()
+        if now - self.explained_at.get(signature, float('-inf')) < SLOW_QUERY_EXPLAIN_INTERVAL:
+            log_slow_command(entry)
+            return
+        self.explained_at[signature] = now
+        asyncio.ensure_future(self.explain(entry, explain_body(command, body), database))
+
+    async def explain(self, entry, body, database):
+        try:
+            explained = await self.client[database].command({'explain': body, 'verbosity': 'executionStats'})
+            entry['plan'] = explain_summary(explained)
+        except Exception as e:
+            entry['plan'] = {'error': str(e)}
+        log_slow_command(entry)
+
+# Request profiler
+# A request sent with `X-Profile: 1` and a valid X-Debug-Token is run normally,
+# but its response is replaced by a sampled profile of it: one line per
+# distinct stack, root first, as "frame;frame;frame count" (the collapsed
+# format flamegraph.pl and speedscope read). A thread samples only this
+# request's task, so concurrent requests on the same event loop don't show up
+# in it; while the task is suspended the sample is the chain of awaits it is
+# parked in, ending in "(waiting)", so time spent on MongoDB is visible too.
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN', '')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 1)) / 1000
+
+def debug_token_valid(token):
+    return bool(DEBUG_TOKEN) and token is not None and hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+
+def frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    def __init__(self, task, thread_id):
+        self.task = task
+        self.thread_id = thread_id
+        self.stacks = Tally()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='request-profiler', daemon=True)
+
+    def running_stack(self, root):
+        # The loop thread's stack, cut at the task's outermost coroutine; None if
+        # another task got the thread between the check and the snapshot
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(frame_name(frame.f_code))
+            if frame is root:
+                return stack[::-1]
+            frame = frame.f_back
+        return None
+
+    def suspended_stack(self, coro):
+        stack = []
+        while coro is not None:
+            frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+            if frame is None:
+                break
+            stack.append(frame_name(frame.f_code))
+            coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+        stack.append('(waiting)')
+        return stack
+
+    def sample(self):
+        coro = self.task.get_coro()
+        if coro.cr_frame is None:
+            return
+        stack = self.running_stack(coro.cr_frame) if coro.cr_running else self.suspended_stack(coro)
+        if stack:
+            self.stacks[';'.join(stack)] += 1
+
+    def run(self):
+        while not self.stopped.wait(PROFILE_INTERVAL):
+            self.sample()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope['headers']}
+        if headers.get('x-profile') != '1' or not debug_token_valid(headers.get('x-debug-token')):
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+        started = time.perf_counter()
+        with StackSampler(asyncio.current_task(), threading.get_ident()) as sampler:
+            try:
+                await self.app(scope, receive, discard)
+            except Exception:
+                logger.exception("Profiled request failed")
+        duration = time.perf_counter() - started
+        body = ''.join(f'{stack} {count}\n' for stack, count in sampler.stacks.most_common()).encode()
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/plain; charset=utf-8'),
+            (b'content-length', str(len(body)).encode()),
+            (b'x-profile-status', str(status).encode()),
+            (b'x-profile-duration-ms', f'{duration * 1000:.1f}'.encode()),
+            (b'x-profile-samples', str(sum(sampler.stacks.values())).encode())
+        ]})
+        await send({'type': 'http.response.body', 'body': body})
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    # Connections per server, from the driver's pool events (on its threads)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {state: Tally() for state in ('open', 'in_use', 'waiting', 'checkout_failures')}
+
+    def add(self, event, **changes):
+        with self.lock:
+            for state, change in changes.items():
+                self.counts[state][event.address] += change
+
+    def snapshot(self):
+        with self.lock:
+            return {state: sum(counts.values()) for state, counts in self.counts.items()}
+
+    def pool_created(self, event):
+        pass
+    def pool_ready(self, event):
+        pass
+    def pool_cleared(self, event):
+        pass
+    def pool_closed(self, event):
+        pass
+    def connection_created(self, event):
+        self.add(event, open=1)
+    def connection_ready(self, event):
+        pass
+    def connection_closed(self, event):
+        self.add(event, open=-1)
+    def connection_check_out_started(self, event):
+        self.add(event, waiting=1)
+    def connection_check_out_failed(self, event):
+        self.add(event, waiting=-1, checkout_failures=1)
+    def connection_checked_out(self, event):
+        self.add(event, waiting=-1, in_use=1)
+    def connection_checked_in(self, event):
+        self.add(event, in_use=-1)
+
+def plan_stages(plan):
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+mongo_command_metrics = MongoCommandMetrics()
+mongo_pool_metrics = MongoPoolMetrics()
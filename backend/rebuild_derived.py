@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Recompute the collections derived from workouts and steps.
+
+Writes to workouts and steps update their rollups, personal records, weekly
+step totals and activity bitmaps in separate writes, so a process that dies
+in between leaves them off by that write. This rebuilds them from the source
+collections for the given users (default: every user). The API can keep
+serving meanwhile; each user's cached responses are dropped once their
+rebuild is done.
+
+    python rebuild_derived.py [--user ID ...] [--only rollups,records,step_weeks,activity]
+"""
+
+import argparse
+import asyncio
+import time
+
+import server
+
+REBUILDS = {
+    'rollups': server.rebuild_workout_rollups,
+    'records': server.rebuild_personal_records,
+    'step_weeks': server.rebuild_step_weeks,
+    'activity': server.rebuild_activity,
+}
+
+
+async def all_users():
+    users = set(await server.db.workouts.distinct('user_id')) | set(await server.db.steps.distinct('user_id'))
+    return sorted(u for u in users if isinstance(u, str))
+
+
+async def rebuild(users, names):
+    users = users or await all_users()
+    started = time.perf_counter()
+    for n, user_id in enumerate(users, 1):
+        for name in names:
+            await REBUILDS[name](user_id)
+        await server.invalidate_cached(user_id, 'workouts', 'steps')
+        print(f"  {n}/{len(users)} users", end='\r', flush=True)
+    print(f"Rebuilt {', '.join(names)} for {len(users)} users in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild derived collections from workouts and steps")
+    parser.add_argument('--user', action='append', dest='users', help="user id; repeat for several (default: all)")
+    parser.add_argument('--only', default=','.join(REBUILDS), help="comma-separated subset of: " + ', '.join(REBUILDS))
+    args = parser.parse_args()
+    names = [n.strip() for n in args.only.split(',') if n.strip()]
+    unknown = [n for n in names if n not in REBUILDS]
+    if unknown:
+        parser.error(f"unknown rebuilds: {', '.join(unknown)}")
+
+    # The app creates its client in the lifespan; this script needs its own
+    server.connect_mongo()
+    try:
+        asyncio.run(rebuild(args.users, names))
+    finally:
+        server.client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,521 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Path as PathParam, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
+import json
+import orjson
+import time
+import asyncio
+import hashlib
+import copy
+import contextlib
+import functools
+import base64
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator
 from typing import List, Optional
-from datetime import datetime, date
-from bson import ObjectId
+from collections import OrderedDict
+from datetime import datetime, date, timedelta, timezone
+from bson import Int64, ObjectId
+from bson.errors import InvalidId
+from catalog import ExerciseCatalog
+from export_import import (
+    EXPORT_CHUNK_ROWS, EXPORT_MEDIA_TYPES, IMPORT_DECODERS, encode_csv, encode_ndjson, encode_parquet,
+    imported_created_at, require_parquet, workout_from_rows, workout_rows
+)
+
+try:
+    import numpy as np
+except ImportError:  # analytics fall back to pure Python
+    np = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Reads its settings from the environment at import, so only once .env is loaded
+from observability import (
+    ProfilingMiddleware, RequestMetricsMiddleware, debug_token_valid, metrics_registry, mongo_command_metrics,
+    mongo_pool_metrics, plan_stages, route_name, slow_command_json, slow_queries
+)
+
+# Metrics
+# HTTP and MongoDB metrics, the slow-query log and the request profiler live in
+# observability.py; the app's own counters are added to its registry here.
+class AppStatsCollector:
+    # Reads the counters the caches and buffers already keep, at scrape time
+    def collect(self):
+        caches = {'response': response_cache, 'catalog': catalog_responses}
+        entries = GaugeMetricFamily('response_cache_entries', 'Cached responses', labels=['cache'])
+        for field in ('hits', 'misses', 'evictions'):
+            family = CounterMetricFamily(f'response_cache_{field}', f'Response cache {field}', labels=['cache'])
+            for name, cache in caches.items():
+                family.add_metric([name], cache.metrics[field])
+            yield family
+        for name, cache in caches.items():
+            entries.add_metric([name], len(cache.entries))
+        yield entries
+
+        for field in ('executions', 'coalesced', 'timeouts'):
+            family = CounterMetricFamily(f'singleflight_{field}', f'Single-flight {field}', labels=['route'])
+            for name, counters in singleflight.metrics.items():
+                family.add_metric([name], counters[field])
+            yield family
+        yield GaugeMetricFamily('singleflight_in_flight', 'Shared computations running', value=len(singleflight.calls))
+
+        for field, value in step_log_buffer.metrics.items():
+            yield CounterMetricFamily(f'step_buffer_{field}', f'Step write-behind {field}', value=value)
+        yield GaugeMetricFamily('step_buffer_pending', 'Buffered step days', value=step_log_buffer.size())
+
+        pool = mongo_pool_metrics.snapshot()
+        connections = GaugeMetricFamily('mongodb_pool_connections', 'Pooled MongoDB connections', labels=['state'])
+        for state in ('open', 'in_use', 'waiting'):
+            connections.add_metric([state], pool[state])
+        yield connections
+        yield GaugeMetricFamily('mongodb_pool_max_size', 'Pool size limit', value=mongo_settings['maxPoolSize'])
+        yield CounterMetricFamily(
+            'mongodb_pool_checkout_failures', 'Requests that got no connection', value=pool['checkout_failures']
+        )
+
+metrics_registry.register(AppStatsCollector())
+
 # MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# The client is created in the app lifespan, on the loop that serves requests,
+# and closed there too. Pool size, timeouts and read preference come from the
+# environment; the pool is filled to its minimum before the app takes traffic,
+# so a new worker's first requests don't pay for connection handshakes.
+MONGO_CLIENT_SETTINGS = [
+    # (client option, environment variable, default)
+    ('maxPoolSize', 'MONGO_MAX_POOL_SIZE', 100),
+    ('minPoolSize', 'MONGO_MIN_POOL_SIZE', 10),
+    ('maxIdleTimeMS', 'MONGO_MAX_IDLE_TIME_MS', 300_000),
+    ('waitQueueTimeoutMS', 'MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000),
+    ('connectTimeoutMS', 'MONGO_CONNECT_TIMEOUT_MS', 5000),
+    ('serverSelectionTimeoutMS', 'MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+    ('socketTimeoutMS', 'MONGO_SOCKET_TIMEOUT_MS', None),
+    ('readPreference', 'MONGO_READ_PREFERENCE', 'primary'),
+]
+# The readiness probe fails while every pooled connection is busy and requests
+# are queued for one, if the busy share is at least this
+MONGO_READY_MAX_SATURATION = float(os.environ.get('MONGO_READY_MAX_SATURATION', 1.0))
+HEALTH_PING_TIMEOUT = float(os.environ.get('HEALTH_PING_TIMEOUT_SECONDS', 2))
+
+def mongo_client_settings():
+    settings = {}
+    for option, variable, default in MONGO_CLIENT_SETTINGS:
+        value = os.environ.get(variable)
+        if value is None:
+            settings[option] = default
+        elif option == 'readPreference':
+            settings[option] = value
+        else:
+            settings[option] = int(value)
+    return settings
+
+mongo_settings = mongo_client_settings()
+client = None
+db = None
+
+def connect_mongo():
+    global client, db
+    client = AsyncIOMotorClient(
+        os.environ['MONGO_URL'], event_listeners=[mongo_command_metrics, mongo_pool_metrics], **mongo_settings
+    )
+    db = client[os.environ['DB_NAME']]
+    mongo_command_metrics.client = client  # slow commands are explained through it
+    return client
+
+async def warm_up_pool():
+    # Concurrent pings each check out their own connection, opening minPoolSize
+    # of them now instead of on the first requests
+    started = time.perf_counter()
+    await asyncio.gather(*(client.admin.command('ping') for _ in range(max(mongo_settings['minPoolSize'], 1))))
+    logger.info(
+        f"MongoDB pool warmed up: {mongo_pool_metrics.snapshot()['open']} connections "
+        f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.ready = False
+    connect_mongo()
+    try:
+        await prepare_database()
+        app.state.ready = True
+        yield
+    finally:
+        app.state.ready = False
+        try:
+            await step_log_buffer.close()
+        finally:
+            client.close()
 
 # Create the main app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+app.state.ready = False
 api_router = APIRouter(prefix="/api")
 
+# Users
+# Every document carries the user_id it belongs to and every query has it as an
+# equality prefix: indexes lead with user_id and each collection can be sharded
+# on it. There is no authentication in this service; X-User-Id is trusted and
+# expected to be set by whatever authenticates requests in front of it.
+DEFAULT_USER_ID = os.environ.get('DEFAULT_USER_ID', 'default')
+
+def current_user(x_user_id: Optional[str] = Header(None, pattern=r'^[A-Za-z0-9_-]{1,64}$')):
+    return x_user_id or DEFAULT_USER_ID
+
+def user_key(user_id, *parts):
+    # _id of per-user keyed documents; user ids cannot contain ':'
+    return ':'.join((user_id, *parts))
+
+def user_key_range(user_id):
+    # Matches every user_key(user_id, ...) _id (';' sorts right after ':')
+    return {'$gt': f'{user_id}:', '$lt': f'{user_id};'}
+
+def user_tags(user_id, *names):
+    # Response cache tags, so a write only invalidates its own user's entries
+    return tuple(f'{name}:{user_id}' for name in names)
+
 # Helper function to serialize ObjectId
 def serialize_doc(doc):
     if doc and '_id' in doc:
         doc['_id'] = str(doc['_id'])
     return doc
 
+# Fast path: encode Mongo documents as they come off the cursor, converting
+# ObjectId in the encoder instead of copying/mutating every document
+def _json_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps_json(data):
+    return orjson.dumps(data, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+
+# Keyset pagination over (date, _id) descending; the cursor is opaque to clients
+PAGE_SORT = [('date', -1), ('_id', -1)]
+
+def encode_cursor(doc):
+    raw = json.dumps([doc['date'], str(doc['_id'])]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        last_date, last_id = json.loads(raw)
+        return last_date, ObjectId(last_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def date_range_query(start_date, end_date):
+    query = {}
+    if start_date and end_date:
+        query['date'] = {'$gte': start_date, '$lte': end_date}
+    return query
+
+def keyset_query(query, cursor):
+    if not cursor:
+        return query
+    last_date, last_id = decode_cursor(cursor)
+    after = {'$or': [
+        {'date': {'$lt': last_date}},
+        {'date': last_date, '_id': {'$lt': last_id}}
+    ]}
+    return {'$and': [query, after]} if query else after
+
+async def paginate(collection, query, cursor, limit, projection=None, decode=None):
+    # Returns (docs, headers) with the next-page cursor in X-Next-Cursor
+    docs = await db[collection].find(keyset_query(query, cursor), projection).sort(PAGE_SORT).to_list(limit + 1)
+    headers = {}
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(docs[-1])
+    if decode:
+        docs = [decode(d) for d in docs]
+    return docs, headers
+
+def stream_ndjson(collection, query, cursor, limit=None, projection=None, decode=None):
+    # Yields documents straight off the Motor cursor, one JSON object per line
+    async def lines():
+        mongo_cursor = db[collection].find(keyset_query(query, cursor), projection).sort(PAGE_SORT)
+        if limit:
+            mongo_cursor = mongo_cursor.limit(limit)
+        async for doc in mongo_cursor:
+            yield dumps_json(decode(doc) if decode else doc) + b'\n'
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+# Fields a caller may request from GET /workouts; date is always returned since
+# the pagination cursor is built from it
+WORKOUT_FIELDS = ('date', 'exercises', 'duration', 'notes', 'created_at', 'updated_at')
+
+def workout_projection(fields, view):
+    if fields:
+        requested = {f.strip() for f in fields.split(',') if f.strip()}
+        unknown = requested - set(WORKOUT_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        # 'v' tells decode_workout which storage format it is reading
+        projection = {f: 1 for f in requested | {'date', 'v'}}
+        if view == 'summary' and 'exercises' in projection:
+            del projection['exercises']
+            projection['exercises.name'] = projection['exercises.category'] = 1
+        return projection
+    if view == 'summary':
+        return {'exercises.sets': 0, 'exercises.reps': 0, 'exercises.weight': 0, 'exercises.skipped': 0}
+    return None
+
+def workout_decoder(projection):
+    # Null optional fields are only filled in when the caller did not pick fields
+    fill_defaults = projection is None or not any(projection.values())
+    return lambda doc: decode_workout(doc, fill_defaults)
+
+# Response cache
+# Bounded LRU + TTL cache of encoded GET responses, tagged by the collections they
+# read. Writes invalidate by tag; a per-tag generation counter stops a response
+# computed before an invalidation from being stored after it. Both are local to
+# the worker, so per-user entries also carry the user's change version (see
+# Change tracking) and are dropped once another worker's write moves it.
+class ResponseCache:
+    def __init__(self, max_entries=512, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.metrics = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def generation(self, tags):
+        return tuple(self.generations.get(tag, 0) for tag in tags)
+
+    def get(self, key, version=None):
+        entry = self.entries.get(key)
+        if entry is not None and (entry['expires'] < time.monotonic() or entry['version'] != version):
+            del self.entries[key]
+            entry = None
+        if entry is None:
+            self.metrics['misses'] += 1
+            return None
+        self.metrics['hits'] += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key, entry, tags, generation, version=None):
+        if self.generation(tags) != generation:
+            return
+        entry['tags'] = tags
+        entry['version'] = version
+        entry['expires'] = time.monotonic() + self.ttl
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.metrics['evictions'] += 1
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+        stale = [k for k, e in self.entries.items() if set(e['tags']) & set(tags)]
+        for key in stale:
+            del self.entries[key]
+
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('CACHE_MAX_ENTRIES', 512)),
+    ttl=float(os.environ.get('CACHE_TTL_SECONDS', 60))
+)
+
+# Single-flight: concurrent identical requests share one in-flight computation.
+# Waiters time out individually (shielded), so a slow leader keeps running and
+# still fills the cache for the next caller.
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.metrics = {}
+
+    def _count(self, name, field):
+        counters = self.metrics.setdefault(name, {'executions': 0, 'coalesced': 0, 'timeouts': 0})
+        counters[field] += 1
+
+    async def do(self, key, fn, name='default', timeout=None):
+        future = self.calls.get(key)
+        if future is None:
+            self._count(name, 'executions')
+            future = asyncio.ensure_future(fn())
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self._finish(key, f))
+        else:
+            self._count(name, 'coalesced')
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self._count(name, 'timeouts')
+            raise HTTPException(status_code=504, detail="Timed out waiting for a shared computation")
+
+    def _finish(self, key, future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        if not future.cancelled():
+            future.exception()  # mark retrieved even if every waiter timed out
+
+singleflight = SingleFlight()
+SINGLEFLIGHT_TIMEOUT = float(os.environ.get('SINGLEFLIGHT_TIMEOUT_SECONDS', 10))
+
+# Write-behind: coalesces writes per key (last write wins) and hands them to
+# flush() as one batch, once `interval` seconds after the first buffered write or
+# as soon as `max_entries` keys are waiting. Memory is bounded by refusing new
+# keys: a writer that finds the buffer full waits for a flush to make room, and
+# gets BufferFull if that flush fails. A failed flush is re-queued behind any
+# newer writes, which stays within the bound since keys being flushed count
+# towards it.
+class BufferFull(Exception):
+    pass
+
+class WriteBehindBuffer:
+    def __init__(self, flush, max_entries=500, interval=1.0):
+        self.flush_batch = flush
+        self.max_entries = max_entries
+        self.interval = interval
+        self.pending = {}
+        self.flushing = {}
+        self.lock = asyncio.Lock()
+        self.timer = None
+        self.metrics = {'writes': 0, 'flushes': 0, 'flushed_entries': 0, 'failed_flushes': 0, 'rejected': 0}
+
+    def size(self):
+        return len(self.pending) + len(self.flushing)
+
+    async def put(self, key, value):
+        if key not in self.pending and self.size() >= self.max_entries:
+            try:
+                await self.flush()
+            except Exception as e:
+                self.metrics['rejected'] += 1
+                raise BufferFull() from e
+            if self.size() >= self.max_entries:
+                # Refilled by other writers while this one waited
+                self.metrics['rejected'] += 1
+                raise BufferFull()
+        self.metrics['writes'] += 1
+        self.pending[key] = value
+        if self.size() >= self.max_entries:
+            asyncio.ensure_future(self._flush_logged())
+        elif self.timer is None:
+            self.timer = asyncio.ensure_future(self._flush_later())
+
+    def discard(self, key):
+        # True if a buffered write was dropped
+        return self.pending.pop(key, None) is not None
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        self.timer = None
+        await self._flush_logged()
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Write-behind flush failed: {e}")
+
+    async def flush(self):
+        async with self.lock:
+            batch, self.pending = self.pending, {}
+            if not batch:
+                return
+            self.flushing = batch
+            try:
+                await self.flush_batch(batch)
+            except Exception:
+                self.metrics['failed_flushes'] += 1
+                self.pending = {**batch, **self.pending}
+                if self.timer is None:
+                    self.timer = asyncio.ensure_future(self._flush_later())
+                raise
+            finally:
+                self.flushing = {}
+            self.metrics['flushes'] += 1
+            self.metrics['flushed_entries'] += len(batch)
+
+    async def close(self):
+        await self.flush()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+def etag_matches(request: Request, etag):
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+async def cached_json(
+    request: Request, tags, compute, key_extra=(), timeout=SINGLEFLIGHT_TIMEOUT,
+    cache=response_cache, cache_control='no-cache', user_id=None
+):
+    # compute() returns (data, headers); the encoded body and headers are cached.
+    # Tags are part of the key since per-user tags carry the user. With user_id,
+    # the entry is only reused while that user's change version is unchanged.
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())), tags, *key_extra)
+    version = await change_version(user_id) if user_id is not None else None
+    entry = cache.get(key, version)
+    if entry is None:
+        generation = cache.generation(tags)
+
+        async def build():
+            data, headers = await compute()
+            body = dumps_json(data)
+            built = {
+                'body': body,
+                'headers': {**headers, 'ETag': f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'}
+            }
+            cache.set(key, built, tags, generation, version)
+            return built
+
+        # The generation and version are part of the flight key so requests
+        # arriving after a write never join a computation that started before it
+        entry = await singleflight.do((key, generation, version), build, name=route_name(request.scope), timeout=timeout)
+
+    headers = {**entry['headers'], 'Cache-Control': cache_control}
+    if etag_matches(request, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    return Response(entry['body'], media_type='application/json', headers=headers)
+
+# Per-section timing, reported in a Server-Timing header
+async def timed(timings, name, awaitable):
+    if timings is None:
+        return await awaitable
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[name] = (time.perf_counter() - started) * 1000
+
+def server_timing(timings):
+    return ', '.join(f'{name};dur={ms:.1f}' for name, ms in timings.items())
+
 # Models
+def calendar_day(value):
+    # Strict YYYY-MM-DD: dates are indexed, paged and compared as strings, and
+    # fromisoformat alone also accepts forms like '20261016' or '2026-W42-1'
+    if date.fromisoformat(value).isoformat() != value:
+        raise ValueError(f"Expected a YYYY-MM-DD date, got {value!r}")
+    return value
+
+def parse_day(value):
+    # None for dates stored before they were validated
+    try:
+        return date.fromisoformat(calendar_day(value))
+    except (TypeError, ValueError):
+        return None
+
+MAX_SETS_PER_EXERCISE = 50  # bounded by the v2 'skipped' bitmask (see Storage format)
+
 class ExerciseSet(BaseModel):
     reps: int
     weight: float
@@ -37,7 +524,7 @@ class ExerciseSet(BaseModel):
 class Exercise(BaseModel):
     name: str
     category: str
-    sets: List[ExerciseSet]
+    sets: List[ExerciseSet] = Field(max_length=MAX_SETS_PER_EXERCISE)
 
 class WorkoutCreate(BaseModel):
     date: str
@@ -45,6 +532,11 @@ class WorkoutCreate(BaseModel):
     duration: Optional[int] = None  # in minutes
     notes: Optional[str] = None
 
+    @field_validator('date')
+    @classmethod
+    def check_date(cls, value):
+        return calendar_day(value)  # series and activity parse it as a calendar day
+
 class Workout(BaseModel):
     id: str = Field(alias="_id")
     date: str
@@ -56,10 +548,28 @@ class Workout(BaseModel):
     class Config:
         populate_by_name = True
 
+class ExercisePatch(BaseModel):
+    name: Optional[str] = None
+    category: Optional[str] = None
+
+class ExerciseSetPatch(BaseModel):
+    reps: Optional[int] = None
+    weight: Optional[float] = None
+    completed: Optional[bool] = None
+
 class StepLog(BaseModel):
     date: str
     steps: int
 
+    @field_validator('date')
+    @classmethod
+    def check_date(cls, value):
+        return calendar_day(value)  # the weekly rollup is keyed off it
+
+class StepSample(BaseModel):
+    timestamp: datetime  # device wall-clock time; bucketed as-is
+    steps: int = Field(ge=0)
+
 class WorkoutStats(BaseModel):
     total_workouts: int
     total_duration: int
@@ -67,148 +577,1892 @@ class WorkoutStats(BaseModel):
     workouts_this_month: int
     total_steps_today: int
 
-# Exercise templates
-EXERCISE_LIBRARY = [
-    {"name": "Bench Press", "category": "Chest"},
-    {"name": "Push Ups", "category": "Chest"},
-    {"name": "Incline Dumbbell Press", "category": "Chest"},
-    {"name": "Squats", "category": "Legs"},
-    {"name": "Leg Press", "category": "Legs"},
-    {"name": "Lunges", "category": "Legs"},
-    {"name": "Deadlifts", "category": "Back"},
-    {"name": "Pull Ups", "category": "Back"},
-    {"name": "Bent Over Rows", "category": "Back"},
-    {"name": "Overhead Press", "category": "Shoulders"},
-    {"name": "Lateral Raises", "category": "Shoulders"},
-    {"name": "Front Raises", "category": "Shoulders"},
-    {"name": "Bicep Curls", "category": "Arms"},
-    {"name": "Tricep Dips", "category": "Arms"},
-    {"name": "Hammer Curls", "category": "Arms"},
-    {"name": "Planks", "category": "Core"},
-    {"name": "Crunches", "category": "Core"},
-    {"name": "Russian Twists", "category": "Core"},
+# Change tracking
+# Every workout and step write stamps the document with updated_at and `seq`, a
+# per-user counter shared by both collections; deletes leave a tombstone under a
+# fresh seq. GET /sync returns everything above a client's resume token in seq order.
+# A seq is allocated before its write lands. So that sync never hands out a
+# token that a slower write then lands behind, in any worker, each allocation
+# is recorded in the counter document's `pending` list in the same update and
+# removed once the write is done, and sync stops short of the oldest pending
+# seq. A pending entry whose writer died expires after
+# SYNC_PENDING_LEASE_SECONDS; this is the remaining gap: a write that lands
+# more than that long after its seq was allocated (or worker clocks further
+# apart than that) can still be missed by a client that synced in between.
+SYNC_COUNTER_ID = 'sync'
+SYNC_COLLECTIONS = ('workouts', 'steps')
+# Tokens older than this get 410 and the client starts over; tombstones are
+# kept a day longer
+SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', 30))
+SYNC_PENDING_LEASE_SECONDS = float(os.environ.get('SYNC_PENDING_LEASE_SECONDS', 60))
+
+async def allocate_seqs(user_id, count=1):
+    # Bumps the counter and records the range as pending, dropping expired entries
+    now = datetime.utcnow()
+    expired = now - timedelta(seconds=SYNC_PENDING_LEASE_SECONDS)
+    counter = await db.counters.find_one_and_update(
+        {'_id': user_key(user_id, SYNC_COUNTER_ID)},
+        [
+            {'$set': {'seq': {'$add': [{'$ifNull': ['$seq', 0]}, count]}}},
+            {'$set': {'pending': {'$concatArrays': [
+                {'$filter': {'input': {'$ifNull': ['$pending', []]}, 'cond': {'$gt': ['$$this.at', expired]}}},
+                [{'first': {'$subtract': ['$seq', count - 1]}, 'at': now}]
+            ]}}}
+        ],
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return range(counter['seq'] - count + 1, counter['seq'] + 1)
+
+async def release_seqs(user_id, seqs):
+    await db.counters.update_one(
+        {'_id': user_key(user_id, SYNC_COUNTER_ID)}, {'$pull': {'pending': {'first': seqs.start}}}
+    )
+
+async def settled_seq(user_id):
+    # Highest seq below which every allocated seq has been written (or expired)
+    counter = await db.counters.find_one({'_id': user_key(user_id, SYNC_COUNTER_ID)})
+    if counter is None:
+        return 0
+    expired = datetime.utcnow() - timedelta(seconds=SYNC_PENDING_LEASE_SECONDS)
+    pending = [p['first'] for p in counter.get('pending', []) if p['at'] > expired]
+    return min(pending) - 1 if pending else counter['seq']
+
+async def change_version(user_id):
+    # Moves with every allocation and release, and once the derived collections
+    # are updated, so a value read before a computation still matches afterwards
+    # only if no write started or finished in between
+    counter = await db.counters.find_one(
+        {'_id': user_key(user_id, SYNC_COUNTER_ID)}, {'seq': 1, 'pending.first': 1, 'derived': 1}
+    )
+    if counter is None:
+        return (0, (), 0)
+    return (counter['seq'], tuple(p['first'] for p in counter.get('pending', [])), counter.get('derived', 0))
+
+async def invalidate_cached(user_id, *names):
+    # After a write and its derived updates: drops this worker's entries and
+    # moves the change version for the others
+    response_cache.invalidate(*user_tags(user_id, *names))
+    await db.counters.update_one({'_id': user_key(user_id, SYNC_COUNTER_ID)}, {'$inc': {'derived': 1}})
+
+@contextlib.asynccontextmanager
+async def change_stamps(user_id, count=1):
+    # Yields `count` {'seq', 'updated_at'} stamps, held pending until the write is done
+    seqs = await allocate_seqs(user_id, count)
+    now = datetime.utcnow()
+    try:
+        yield [{'seq': seq, 'updated_at': now} for seq in seqs]
+    finally:
+        await release_seqs(user_id, seqs)
+
+def stamped(update, stamp):
+    # Adds the stamp to an update document or pipeline
+    if isinstance(update, list):
+        return [*update, {'$set': stamp}]
+    return {**update, '$set': {**update.get('$set', {}), **stamp}}
+
+async def add_tombstone(user_id, collection, key, stamp):
+    await db.sync_tombstones.insert_one({
+        'user_id': user_id, 'collection': collection, 'key': key,
+        'seq': stamp['seq'], 'deleted_at': stamp['updated_at']
+    })
+
+def encode_sync_token(seq, issued_at):
+    raw = json.dumps([seq, int(issued_at)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_sync_token(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        seq, issued_at = json.loads(raw)
+        return int(seq), int(issued_at)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+async def compute_sync(user_id, last_seq, limit):
+    # Read before the changes: everything up to it has landed by then
+    seq_range = {'$gt': last_seq, '$lte': await settled_seq(user_id)}
+
+    def changes(collection):
+        query = {'user_id': user_id, 'seq': seq_range}
+        return db[collection].find(query).sort('seq', 1).to_list(limit + 1)
+
+    found = await asyncio.gather(*(changes(c) for c in (*SYNC_COLLECTIONS, 'sync_tombstones')))
+    tagged = [(doc['seq'], name, doc) for name, docs in zip((*SYNC_COLLECTIONS, 'deleted'), found) for doc in docs]
+    tagged.sort(key=lambda t: t[0])
+    has_more = len(tagged) > limit
+    tagged = tagged[:limit]
+
+    result = {'workouts': [], 'steps': [], 'deleted': {c: [] for c in SYNC_COLLECTIONS}}
+    for _, name, doc in tagged:
+        if name == 'deleted':
+            result['deleted'][doc['collection']].append(doc['key'])
+        elif name == 'workouts':
+            result['workouts'].append(serialize_doc(decode_workout(doc)))
+        else:
+            result['steps'].append({'date': doc['date'], 'steps': doc['steps'], 'updated_at': doc['updated_at'].isoformat()})
+    # A partial page resumes from its last change, dated by that change so
+    # tombstones after it are still retained when the token is used
+    if tagged:
+        last = tagged[-1][2]
+        changed_at = last.get('updated_at') or last['deleted_at']
+        issued_at = changed_at.replace(tzinfo=timezone.utc).timestamp() if has_more else time.time()
+        result['next'] = encode_sync_token(tagged[-1][0], issued_at)
+    else:
+        result['next'] = encode_sync_token(last_seq, time.time())
+    result['has_more'] = has_more
+    return result
+
+async def backfill_sync_seqs(batch_size=1000):
+    # Documents written before change tracking get a seq so a first sync returns them
+    for collection in SYNC_COLLECTIONS:
+        while True:
+            docs = await db[collection].find({'seq': {'$exists': False}}, {'_id': 1, 'user_id': 1}).to_list(batch_size)
+            if not docs:
+                break
+            by_user = {}
+            for d in docs:
+                by_user.setdefault(d['user_id'], []).append(d['_id'])
+            for user_id, ids in by_user.items():
+                async with change_stamps(user_id, len(ids)) as stamps:
+                    await db[collection].bulk_write([
+                        UpdateOne({'_id': _id, 'seq': {'$exists': False}}, {'$set': stamp})
+                        for _id, stamp in zip(ids, stamps)
+                    ], ordered=False)
+
+# Storage format
+# v2 workouts store each exercise's sets column-wise: reps[], weight[] (integral
+# weights as ints) and a 'skipped' bitmask of sets not completed, omitted when
+# every set was. created_at is a native BSON date and null optional fields are
+# left out. `date` stays a YYYY-MM-DD string: every index, cursor and rollup is
+# keyed on it, and mixing strings and dates during an online migration would
+# break range queries. decode_workout() returns the API shape for either format.
+# Pipelines test the bitmask with double arithmetic, exact up to 53 bits.
+WORKOUT_FORMAT = 2
+
+def compact_number(value):
+    return int(value) if float(value).is_integer() else value
+
+def encodable(doc):
+    # v1 documents written before the set limit can exceed the bitmask
+    return all(len(e.get('sets', [])) <= MAX_SETS_PER_EXERCISE for e in doc.get('exercises', []))
+
+def encode_exercise(exercise):
+    sets = exercise.get('sets', [])
+    encoded = {
+        'name': exercise['name'],
+        'category': exercise['category'],
+        'reps': [s['reps'] for s in sets],
+        'weight': [compact_number(s['weight']) for s in sets]
+    }
+    skipped = sum(1 << i for i, s in enumerate(sets) if s.get('completed') is False)
+    if skipped:
+        encoded['skipped'] = skipped
+    return encoded
+
+def encode_workout(workout):
+    # Takes the API (v1) shape
+    doc = {'_id': workout['_id']} if '_id' in workout else {}
+    if 'user_id' in workout:
+        doc['user_id'] = workout['user_id']
+    doc['v'] = WORKOUT_FORMAT
+    doc['date'] = workout['date']
+    doc['exercises'] = [encode_exercise(e) for e in workout.get('exercises', [])]
+    for field in ('duration', 'notes'):
+        if workout.get(field) is not None:
+            doc[field] = workout[field]
+    created_at = workout.get('created_at')
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    if created_at is not None:
+        doc['created_at'] = created_at
+    for field in ('seq', 'updated_at'):
+        if field in workout:
+            doc[field] = workout[field]
+    return doc
+
+def decode_exercise(exercise):
+    if 'reps' not in exercise:
+        return exercise  # v1 layout, or sets projected away
+    skipped = exercise.get('skipped', 0)
+    return {
+        'name': exercise['name'],
+        'category': exercise['category'],
+        'sets': [
+            {'reps': reps, 'weight': float(weight), 'completed': not (skipped >> i) & 1}
+            for i, (reps, weight) in enumerate(zip(exercise['reps'], exercise['weight']))
+        ]
+    }
+
+def decode_workout(doc, fill_defaults=True):
+    if doc is None or doc.get('v') != WORKOUT_FORMAT:
+        if doc is not None:
+            doc.pop('seq', None)
+            doc.pop('user_id', None)
+        return doc
+    out = {'_id': doc['_id']} if '_id' in doc else {}
+    for field in ('date', 'exercises', 'duration', 'notes', 'created_at', 'updated_at'):
+        if field in doc:
+            out[field] = doc[field]
+        elif fill_defaults and field in ('duration', 'notes'):
+            out[field] = None
+    if 'exercises' in out:
+        out['exercises'] = [decode_exercise(e) for e in out['exercises']]
+    for field in ('created_at', 'updated_at'):
+        if isinstance(out.get(field), datetime):
+            out[field] = out[field].isoformat()
+    return out
+
+def skipped_bit_expr(mask, index):
+    return {'$eq': [{'$mod': [{'$floor': {'$divide': [mask, {'$pow': [2, index]}]}}, 2]}, 1]}
+
+# Rebuilds exercises[].sets for v2 documents so pipelines only deal with one shape
+DECODE_SETS_STAGE = {'$addFields': {'exercises': {'$map': {
+    'input': {'$ifNull': ['$exercises', []]},
+    'as': 'e',
+    'in': {'$cond': [
+        {'$isArray': '$$e.reps'},
+        {'name': '$$e.name', 'category': '$$e.category', 'sets': {'$map': {
+            'input': {'$range': [0, {'$size': '$$e.reps'}]},
+            'as': 'i',
+            'in': {
+                'reps': {'$arrayElemAt': ['$$e.reps', '$$i']},
+                'weight': {'$arrayElemAt': ['$$e.weight', '$$i']},
+                'completed': {'$not': [skipped_bit_expr({'$ifNull': ['$$e.skipped', 0]}, '$$i')]}
+            }
+        }}},
+        '$$e'
+    ]}
+}}}}
+
+async def upgrade_workout(user_id, oid):
+    # Rewrites a single v1 document in place; False if there was nothing to upgrade
+    query = {'_id': oid, 'user_id': user_id, 'v': {'$ne': WORKOUT_FORMAT}}
+    doc = await db.workouts.find_one(query)
+    if doc is None:
+        return False
+    if not encodable(doc):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Workout has an exercise with more than {MAX_SETS_PER_EXERCISE} sets and can't be edited in place"
+        )
+    await db.workouts.replace_one(query, encode_workout(doc))
+    return True
+
+async def modify_workout(user_id, oid, match, update):
+    # Positional updates are written against the v2 layout; a v1 document is
+    # upgraded on first touch and the update retried. Returns the decoded
+    # pre-image and the change stamp written with the update.
+    query = {'_id': oid, 'user_id': user_id, 'v': WORKOUT_FORMAT, **match}
+    async with change_stamps(user_id) as (stamp,):
+        update = stamped(update, stamp)
+        before = await db.workouts.find_one_and_update(query, update, return_document=ReturnDocument.BEFORE)
+        if before is None and await upgrade_workout(user_id, oid):
+            before = await db.workouts.find_one_and_update(query, update, return_document=ReturnDocument.BEFORE)
+    return decode_workout(before), stamp
+
+# Exercise catalog
+# Loaded once at import from EXERCISE_CATALOG_PATH and never mutated, so its
+# responses are cached for the life of the process. Search is in catalog.py.
+EXERCISE_CATALOG_PATH = Path(os.environ.get('EXERCISE_CATALOG_PATH', ROOT_DIR / 'exercise_catalog.json'))
+exercise_catalog = ExerciseCatalog.load(EXERCISE_CATALOG_PATH)
+catalog_responses = ResponseCache(
+    max_entries=int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', 2048)), ttl=float('inf')
+)
+
+# Indexes
+# Declarative registry applied at startup: (collection, keys, options). Every key
+# leads with user_id, matching the equality prefix of every query; it is also
+# the natural shard key. step_hours, step_weeks, workout_rollups and
+# personal_records are keyed by a user-prefixed _id instead.
+INDEXES = [
+    # Range on date + sort by date (GET /workouts, stats), with _id as tie-breaker
+    ('workouts', [('user_id', 1), ('date', -1), ('_id', -1)], {'name': 'user_date_id'}),
+    ('steps', [('user_id', 1), ('date', 1)], {'name': 'user_date_unique', 'unique': True}),
+    ('steps', [('user_id', 1), ('date', -1), ('_id', -1)], {'name': 'user_date_id'}),
+    ('workout_rollups', [('user_id', 1), ('date', 1)], {'name': 'user_date'}),
+    ('personal_records', [('user_id', 1), ('exercise', 1)], {'name': 'user_exercise'}),
+    # Per-exercise analytics: multikey on the nested exercise name
+    ('workouts', [('user_id', 1), ('exercises.name', 1), ('date', 1)], {'name': 'user_exercise_name_date'}),
+    # Delta sync: changes above a resume token, in seq order
+    ('workouts', [('user_id', 1), ('seq', 1)], {'name': 'user_seq'}),
+    ('steps', [('user_id', 1), ('seq', 1)], {'name': 'user_seq'}),
+    ('sync_tombstones', [('user_id', 1), ('seq', 1)], {'name': 'user_seq'}),
+    ('sync_tombstones', [('deleted_at', 1)], {'name': 'deleted_at_ttl', 'expireAfterSeconds': (SYNC_TOMBSTONE_DAYS + 1) * 86400}),
+]
+
+# Superseded by the per-user indexes above; dropped at startup
+OBSOLETE_INDEXES = [
+    ('workouts', 'date_id'),
+    ('workouts', 'exercise_name_date'),
+    ('workouts', 'seq'),
+    ('steps', 'date_unique'),
+    ('steps', 'date_id'),
+    ('steps', 'seq'),
+    ('workout_rollups', 'date'),
+    ('sync_tombstones', 'seq'),
 ]
 
+# Representative query shapes per endpoint, checked with explain() so a missing
+# index shows up as a failed check instead of production latency.
+QUERY_PLANS = {
+    'get_workouts': ('workouts', {'user_id': 'u'}, PAGE_SORT),
+    'get_workouts_range': ('workouts', {'user_id': 'u', 'date': {'$gte': '2000-01-01', '$lte': '2000-01-31'}}, PAGE_SORT),
+    'get_workouts_page': ('workouts', {'$and': [{'user_id': 'u'}, {'$or': [{'date': {'$lt': '2000-01-31'}}, {'date': '2000-01-31', '_id': {'$lt': ObjectId('0' * 24)}}]}]}, PAGE_SORT),
+    'workout_stats_buckets': ('workout_rollups', {'user_id': 'u', 'date': {'$gte': '2000-01-01'}}, None),
+    'exercise_progression': ('workouts', {'user_id': 'u', 'exercises.name': 'Bench Press', 'date': {'$gte': '2000-01-01'}}, None),
+    'personal_records': ('personal_records', {'user_id': 'u'}, [('exercise', 1)]),
+    'get_steps': ('steps', {'user_id': 'u'}, PAGE_SORT),
+    'get_steps_range': ('steps', {'user_id': 'u', 'date': {'$gte': '2000-01-01', '$lte': '2000-01-31'}}, PAGE_SORT),
+    'steps_by_date': ('steps', {'user_id': 'u', 'date': '2000-01-01'}, None),
+    'step_hours_range': ('step_hours', {'_id': {'$gte': 'u:2000-01-01', '$lte': 'u:2000-01-01T23'}}, [('_id', -1)]),
+    'step_weeks_range': ('step_weeks', {'_id': {'$gte': 'u:2000-01-03', '$lte': 'u:2000-03-26'}}, [('_id', -1)]),
+    'export_workouts': ('workouts', {'user_id': 'u'}, [('date', 1), ('_id', 1)]),
+    'activity_years': ('activity_days', {'_id': {'$gte': 'u:2000', '$lte': 'u:2009'}}, None),
+    'sync_workouts': ('workouts', {'user_id': 'u', 'seq': {'$gt': 0}}, [('seq', 1)]),
+    'sync_steps': ('steps', {'user_id': 'u', 'seq': {'$gt': 0}}, [('seq', 1)]),
+    'sync_tombstones': ('sync_tombstones', {'user_id': 'u', 'seq': {'$gt': 0}}, [('seq', 1)]),
+}
+
+async def ensure_indexes():
+    by_collection = {}
+    for collection, keys, options in INDEXES:
+        by_collection.setdefault(collection, []).append(IndexModel(keys, **options))
+    for collection, models in by_collection.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # e.g. duplicate step days written before the unique index existed
+            logger.error(f"Failed to create indexes on {collection}: {e}")
+    for collection, name in OBSOLETE_INDEXES:
+        try:
+            await db[collection].drop_index(name)
+        except OperationFailure:
+            pass  # already dropped
+
+async def check_query_plans():
+    # Returns {name: winning plan stages} for every query that does not use an index
+    failures = {}
+    for name, (collection, query, sort) in QUERY_PLANS.items():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+        if 'COLLSCAN' in stages or not any(s in ('IXSCAN', 'IDHACK', 'EXPRESS_IXSCAN') for s in stages):
+            failures[name] = stages
+    return failures
+
+# Stats rollups
+# workout_rollups holds, per user, one '<user>:totals' document plus one bucket
+# per workout date ('<user>:day:YYYY-MM-DD'). Every workout write applies its delta with $inc so the
+# summary endpoint never has to scan the workouts collection. The rollups are
+# seeded once per database at startup, before the app takes writes, and read
+# as-is afterwards. The workout write and its $inc are separate writes, not a
+# transaction (which needs a replica set), so a process dying between them
+# leaves the rollup off by that write; rebuild_derived.py repairs it.
+ROLLUP_TOTALS_ID = 'totals'
+
+def rollup_delta(deltas, workout_dict, sign=1):
+    bucket = deltas.setdefault(workout_dict['date'], [0, 0])
+    bucket[0] += sign
+    bucket[1] += sign * (workout_dict.get('duration') or 0)
+    return deltas
+
+async def apply_rollup_deltas(user_id, deltas):
+    ops = []
+    total_workouts = total_duration = 0
+    for day, (count, duration) in deltas.items():
+        if not count and not duration:
+            continue
+        ops.append(UpdateOne(
+            {'_id': user_key(user_id, 'day', day)},
+            {'$inc': {'workouts': count, 'duration': duration}, '$set': {'user_id': user_id, 'date': day}},
+            upsert=True
+        ))
+        total_workouts += count
+        total_duration += duration
+    if not ops:
+        return
+    ops.append(UpdateOne(
+        {'_id': user_key(user_id, ROLLUP_TOTALS_ID)},
+        {'$inc': {'total_workouts': total_workouts, 'total_duration': total_duration}},
+        upsert=True
+    ))
+    await db.workout_rollups.bulk_write(ops, ordered=False)
+
+async def rebuild_workout_rollups(user_id):
+    # Recomputes every bucket from scratch; idempotent, used to seed the rollup
+    # on an existing database or to repair drift.
+    ops = []
+    total_workouts = total_duration = 0
+    pipeline = [{'$match': {'user_id': user_id}}, {'$group': {
+        '_id': '$date',
+        'workouts': {'$sum': 1},
+        'duration': {'$sum': {'$ifNull': ['$duration', 0]}}
+    }}]
+    async for bucket in db.workouts.aggregate(pipeline):
+        ops.append(UpdateOne(
+            {'_id': user_key(user_id, 'day', bucket['_id'])},
+            {'$set': {
+                'user_id': user_id, 'date': bucket['_id'],
+                'workouts': bucket['workouts'], 'duration': bucket['duration']
+            }},
+            upsert=True
+        ))
+        total_workouts += bucket['workouts']
+        total_duration += bucket['duration']
+    ops.append(UpdateOne(
+        {'_id': user_key(user_id, ROLLUP_TOTALS_ID)},
+        {'$set': {'user_id': user_id, 'total_workouts': total_workouts, 'total_duration': total_duration}},
+        upsert=True
+    ))
+    await db.workout_rollups.delete_many({'user_id': user_id, 'date': {'$exists': True}})
+    await db.workout_rollups.bulk_write(ops, ordered=False)
+
+async def seed_workout_rollups():
+    # Every user's buckets, then totals, in two server-side passes
+    await db.workout_rollups.delete_many({})
+    has_user = {'$match': {'user_id': {'$type': 'string'}}}
+    await db.workouts.aggregate([
+        has_user,
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'date': '$date'},
+            'workouts': {'$sum': 1},
+            'duration': {'$sum': {'$ifNull': ['$duration', 0]}}
+        }},
+        {'$project': {
+            '_id': {'$concat': ['$_id.user_id', ':day:', '$_id.date']},
+            'user_id': '$_id.user_id', 'date': '$_id.date', 'workouts': 1, 'duration': 1
+        }},
+        {'$merge': {'into': 'workout_rollups', 'whenMatched': 'replace'}}
+    ]).to_list(None)
+    await db.workouts.aggregate([
+        has_user,
+        {'$group': {
+            '_id': '$user_id',
+            'total_workouts': {'$sum': 1},
+            'total_duration': {'$sum': {'$ifNull': ['$duration', 0]}}
+        }},
+        {'$project': {
+            '_id': {'$concat': ['$_id', f':{ROLLUP_TOTALS_ID}']},
+            'user_id': '$_id', 'total_workouts': 1, 'total_duration': 1
+        }},
+        {'$merge': {'into': 'workout_rollups', 'whenMatched': 'replace'}}
+    ]).to_list(None)
+
+# Activity calendar
+# One document per user and year (_id '<user>:<year>') with a bitset of active
+# days per kind: bit n is day n of the year (Jan 1 = 0). 'workouts' marks days
+# with a workout, 'steps' days with at least ACTIVITY_MIN_STEPS. Each bitset is
+# stored as int64 words under '<kind>.<word>' and kept current with $bit on
+# every write, so streaks and heatmaps read a few small documents instead of
+# scanning the history. A concurrent write to the same day in between the read
+# and the $bit can leave its bit off until rebuild_activity().
+ACTIVITY_KINDS = ('workouts', 'steps')
+ACTIVITY_WORD_BITS = 64
+ACTIVITY_MIN_STEPS = int(os.environ.get('ACTIVITY_MIN_STEPS', 1))
+MAX_ACTIVITY_YEARS = 10
+
+def to_int64(value):
+    # Unsigned 64-bit word as the signed value BSON stores
+    return Int64(value - (1 << 64) if value >= 1 << 63 else value)
+
+def activity_bit(day):
+    word, bit = divmod(day.timetuple().tm_yday - 1, ACTIVITY_WORD_BITS)
+    return str(word), 1 << bit
+
+async def set_activity(user_id, kind, days):
+    # days: {YYYY-MM-DD: active}; dates that don't parse are ignored
+    updates = []
+    for value, active in days.items():
+        try:
+            day = date.fromisoformat(value)
+        except ValueError:
+            continue
+        word, mask = activity_bit(day)
+        op = {'or': to_int64(mask)} if active else {'and': to_int64(~mask & (1 << 64) - 1)}
+        updates.append((
+            {'_id': user_key(user_id, str(day.year))},
+            {'$bit': {f'{kind}.{word}': op}, '$set': {'user_id': user_id, 'year': day.year}}
+        ))
+    await upsert_increments('activity_days', updates)
+
+async def refresh_workout_activity(user_id, days):
+    # A day stays active while its rollup bucket still counts a workout
+    keys = [user_key(user_id, 'day', day) for day in days]
+    counts = {
+        b['date']: b.get('workouts', 0)
+        async for b in db.workout_rollups.find({'_id': {'$in': keys}}, {'date': 1, 'workouts': 1})
+    }
+    await set_activity(user_id, 'workouts', {day: counts.get(day, 0) > 0 for day in days})
+
+def add_activity_day(years, kind, value):
+    # years: {year: {kind: {word: bits}}}; dates that don't parse are ignored
+    try:
+        day = date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return
+    word, mask = activity_bit(day)
+    words = years.setdefault(day.year, {k: {} for k in ACTIVITY_KINDS})[kind]
+    words[word] = words.get(word, 0) | mask
+
+def activity_replacements(user_id, years):
+    return [ReplaceOne({'_id': user_key(user_id, str(year))}, {
+        'user_id': user_id, 'year': year,
+        **{kind: {w: to_int64(v) for w, v in words.items()} for kind, words in kinds.items()}
+    }, upsert=True) for year, kinds in years.items()]
+
+def activity_sources(match):
+    # (kind, collection, filter) for the days that count as active
+    return [
+        ('workouts', db.workouts, match),
+        ('steps', db.steps, {**match, 'steps': {'$gte': ACTIVITY_MIN_STEPS}})
+    ]
+
+async def rebuild_activity(user_id):
+    # Recomputes the user's bitsets from workouts and daily step totals.
+    # Idempotent and safe to run concurrently: whole-year replaces, then years
+    # that no longer have any activity are dropped.
+    years = {}
+    for kind, collection, query in activity_sources({'user_id': user_id}):
+        for value in await collection.distinct('date', query):
+            add_activity_day(years, kind, value)
+    ops = activity_replacements(user_id, years)
+    if ops:
+        await db.activity_days.bulk_write(ops, ordered=False)
+    await db.activity_days.delete_many({'_id': user_key_range(user_id), 'year': {'$nin': list(years)}})
+
+async def seed_activity(batch_size=1000):
+    # Every user's bitsets from one grouped pass per source, not a rebuild per user
+    users = {}
+    for kind, collection, match in activity_sources({'user_id': {'$type': 'string'}}):
+        pipeline = [{'$match': match}, {'$group': {'_id': {'user_id': '$user_id', 'date': '$date'}}}]
+        async for group in collection.aggregate(pipeline, allowDiskUse=True):
+            add_activity_day(users.setdefault(group['_id']['user_id'], {}), kind, group['_id']['date'])
+    await db.activity_days.delete_many({})
+    ops = [op for user_id, years in users.items() for op in activity_replacements(user_id, years)]
+    for i in range(0, len(ops), batch_size):
+        await db.activity_days.bulk_write(ops[i:i + batch_size], ordered=False)
+
+async def load_activity(user_id, kinds, first_year=None, last_year=None):
+    # {year: bitmap as an int}, the union of the given kinds
+    if first_year is None:
+        query = {'_id': user_key_range(user_id)}
+    else:
+        query = {'_id': {'$gte': user_key(user_id, str(first_year)), '$lte': user_key(user_id, str(last_year))}}
+    years = {}
+    async for doc in db.activity_days.find(query):
+        bitmap = 0
+        for kind in kinds:
+            for word, value in doc.get(kind, {}).items():
+                bitmap |= (value & (1 << 64) - 1) << int(word) * ACTIVITY_WORD_BITS
+        years[doc['year']] = bitmap
+    return years
+
+def longest_run(bits):
+    # Each step shortens every run of ones by one
+    length = 0
+    while bits:
+        bits &= bits >> 1
+        length += 1
+    return length
+
+def compute_streaks(years, today):
+    # Lays the years end to end as one bitmap, bit 0 = Jan 1 of the first year
+    if not years:
+        return {'current_streak': 0, 'longest_streak': 0, 'active_days_this_year': 0,
+                'total_active_days': 0, 'last_active': None}
+    origin = date(min(years), 1, 1)
+    bits = 0
+    for year, bitmap in years.items():
+        bits |= bitmap << (date(year, 1, 1) - origin).days
+    today_index = (today - origin).days
+    # Today still counts towards the streak before anything is logged for it
+    end = today_index if today_index >= 0 and bits >> today_index & 1 else today_index - 1
+    current = 0
+    if end >= 0:
+        window = (1 << end + 1) - 1
+        gaps = ~bits & window
+        current = end + 1 if not gaps else end - (gaps.bit_length() - 1)
+    past = bits & (1 << today_index + 1) - 1 if today_index >= 0 else 0
+    return {
+        'current_streak': current,
+        'longest_streak': longest_run(bits),
+        'active_days_this_year': years.get(today.year, 0).bit_count(),
+        'total_active_days': bits.bit_count(),
+        'last_active': (origin + timedelta(days=past.bit_length() - 1)).isoformat() if past else None
+    }
+
+def activity_kinds(kind):
+    return ACTIVITY_KINDS if kind == 'any' else (kind,)
+
+# Single hook for everything derived from workouts; called by every write path
+# Returns any personal records the change set, as reported by the write endpoints
+async def record_workout_changes(user_id, added=(), removed=()):
+    response_cache.invalidate(*user_tags(user_id, 'workouts'))
+    try:
+        deltas = {}
+        for w in removed:
+            rollup_delta(deltas, w, sign=-1)
+        for w in added:
+            rollup_delta(deltas, w)
+        await apply_rollup_deltas(user_id, deltas)
+        await refresh_workout_activity(user_id, list(deltas))
+        if removed:
+            # Removing or editing sets can lower a record, so the affected exercises
+            # are recomputed; pure inserts can only raise them.
+            names = {e['name'] for w in [*removed, *added] for e in w.get('exercises', [])}
+            return await recompute_personal_records(user_id, names)
+        return await update_personal_records(user_id, added)
+    finally:
+        # Again once the derived collections are current, in case a read
+        # cached the intermediate state
+        await invalidate_cached(user_id, 'workouts')
+
+# Bulk ingestion
+MAX_BULK_ITEMS = 1000
+
+@functools.lru_cache(maxsize=None)
+def list_adapter(model):
+    return TypeAdapter(List[model])
+
+async def parse_bulk_items(request: Request, model):
+    # One orjson parse plus one list validation; per-item errors are only
+    # worked out when the fast path fails.
+    try:
+        raw = orjson.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(raw, list):
+        raise HTTPException(status_code=422, detail="Expected a JSON array")
+    if len(raw) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items per request")
+
+    try:
+        return list(enumerate(list_adapter(model).validate_python(raw))), []
+    except ValidationError as e:
+        errors = {}
+        for err in e.errors():
+            errors.setdefault(err['loc'][0], []).append(
+                {'loc': list(err['loc'][1:]), 'msg': err['msg']}
+            )
+    valid = [(i, model.model_validate(item)) for i, item in enumerate(raw) if i not in errors]
+    invalid = [{'index': i, 'status': 'invalid', 'errors': errs} for i, errs in errors.items()]
+    return valid, invalid
+
+def bulk_report(results, ok_status):
+    results.sort(key=lambda r: r['index'])
+    succeeded = sum(1 for r in results if r['status'] == ok_status)
+    failed = sum(1 for r in results if r['status'] in ('invalid', 'error'))
+    return {ok_status: succeeded, 'failed': failed, 'results': results}
+
+# Time-series aggregation
+MAX_SERIES_BUCKETS = 1100
+
+def parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected YYYY-MM-DD")
+
+def series_period(day, granularity):
+    if granularity == 'week':
+        return (day - timedelta(days=day.weekday())).isoformat()
+    if granularity == 'month':
+        return day.isoformat()[:7]
+    return day.isoformat()
+
+def series_periods(start, end, granularity):
+    periods = []
+    day = start
+    while day <= end:
+        period = series_period(day, granularity)
+        if not periods or periods[-1] != period:
+            periods.append(period)
+        day += timedelta(days=1)
+    return periods
+
+def series_period_expr(granularity):
+    if granularity == 'day':
+        return '$date'
+    if granularity == 'month':
+        return {'$substrCP': ['$date', 0, 7]}
+    # Monday of the ISO week, as YYYY-MM-DD; dates stored before they were
+    # validated that don't parse are left out instead of failing the query
+    day = {'$dateFromString': {'dateString': '$date', 'onError': None}}
+    monday = {'$subtract': [day, {'$multiply': [{'$subtract': [{'$isoDayOfWeek': day}, 1]}, 86400000]}]}
+    return {'$dateToString': {'format': '%Y-%m-%d', 'date': monday}}
+
+def completed_sets_expr(exercise):
+    return {'$filter': {'input': f'{exercise}.sets', 'as': 's', 'cond': {'$ne': ['$$s.completed', False]}}}
+
+async def compute_workout_series(user_id, start, end, granularity):
+    exercises = {'$ifNull': ['$exercises', []]}
+    pipeline = [
+        {'$match': {'user_id': user_id, 'date': {'$gte': start.isoformat(), '$lte': end.isoformat()}}},
+        DECODE_SETS_STAGE,
+        {'$project': {
+            'period': series_period_expr(granularity),
+            'duration': {'$ifNull': ['$duration', 0]},
+            'exercises': {'$size': exercises},
+            'sets': {'$sum': {'$map': {
+                'input': exercises, 'as': 'e',
+                'in': {'$size': completed_sets_expr('$$e')}
+            }}},
+            'volume': {'$sum': {'$map': {
+                'input': exercises, 'as': 'e',
+                'in': {'$sum': {'$map': {
+                    'input': completed_sets_expr('$$e'), 'as': 's',
+                    'in': {'$multiply': ['$$s.reps', '$$s.weight']}
+                }}}
+            }}}
+        }},
+        {'$group': {
+            '_id': '$period',
+            'workouts': {'$sum': 1},
+            'exercises': {'$sum': '$exercises'},
+            'sets': {'$sum': '$sets'},
+            'volume': {'$sum': '$volume'},
+            'duration': {'$sum': '$duration'}
+        }}
+    ]
+    grouped = {b['_id']: b async for b in db.workouts.aggregate(pipeline)}
+    buckets = []
+    for period in series_periods(start, end, granularity):
+        b = grouped.get(period, {})
+        buckets.append({
+            'period': period,
+            'workouts': b.get('workouts', 0),
+            'exercises': b.get('exercises', 0),
+            'sets': b.get('sets', 0),
+            'volume': b.get('volume', 0),
+            'duration': b.get('duration', 0)
+        })
+    return buckets
+
+# Exercise analytics
+# Estimated one-rep max uses the Epley formula; a single rep is the lift itself
+# Sets that count towards progression and records: completed, and at least one
+# rep (a 0-rep set is a failed attempt, not a lift at that weight)
+LIFTED_SET_MATCH = {'$match': {'exercises.sets.completed': {'$ne': False}, 'exercises.sets.reps': {'$gte': 1}}}
+
+def is_lifted_set(s):
+    return s.get('completed') is not False and s['reps'] >= 1
+
+def estimate_1rm(weight, reps):
+    return weight if reps <= 1 else weight * (1 + reps / 30)
+
+def estimate_1rm_expr(weight, reps):
+    return {'$cond': [
+        {'$lte': [reps, 1]},
+        weight,
+        {'$multiply': [weight, {'$add': [1, {'$divide': [reps, 30]}]}]}
+    ]}
+
+def rolling_mean(values, window):
+    # Trailing mean over up to `window` sessions (shorter at the start of the series)
+    if np is not None:
+        arr = np.asarray(values, dtype=float)
+        csum = np.concatenate(([0.0], np.cumsum(arr)))
+        idx = np.arange(1, len(arr) + 1)
+        lo = np.maximum(0, idx - window)
+        return ((csum[idx] - csum[lo]) / (idx - lo)).tolist()
+    out, total = [], 0.0
+    for i, value in enumerate(values):
+        total += value
+        if i >= window:
+            total -= values[i - window]
+        out.append(total / min(i + 1, window))
+    return out
+
+def trend_slope(xs, ys):
+    # Least-squares slope of ys over xs; None without enough distinct points
+    if len(set(xs)) < 2:
+        return None
+    if np is not None:
+        return float(np.polyfit(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float), 1)[0])
+    n = len(xs)
+    mean_x, mean_y = sum(xs) / n, sum(ys) / n
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    return sxy / sxx
+
+async def compute_exercise_progression(exercise_name, query, window):
+    pipeline = [
+        {'$match': {'exercises.name': exercise_name, **query}},
+        {'$project': {'date': 1, 'exercises': 1}},
+        DECODE_SETS_STAGE,
+        {'$unwind': '$exercises'},
+        {'$match': {'exercises.name': exercise_name}},
+        {'$unwind': '$exercises.sets'},
+        LIFTED_SET_MATCH,
+        {'$project': {
+            'date': 1,
+            'reps': '$exercises.sets.reps',
+            'weight': '$exercises.sets.weight',
+            'volume': {'$multiply': ['$exercises.sets.reps', '$exercises.sets.weight']},
+            'e1rm': estimate_1rm_expr('$exercises.sets.weight', '$exercises.sets.reps')
+        }},
+        {'$group': {
+            '_id': '$date',
+            'sets': {'$sum': 1},
+            'reps': {'$sum': '$reps'},
+            'volume': {'$sum': '$volume'},
+            # Heaviest set, ties broken by reps
+            'top_set': {'$max': {'weight': '$weight', 'reps': '$reps'}},
+            'e1rm': {'$max': '$e1rm'}
+        }},
+        {'$sort': {'_id': 1}}
+    ]
+    points = [
+        {
+            'date': p['_id'],
+            'sets': p['sets'],
+            'reps': p['reps'],
+            'volume': p['volume'],
+            'top_set': p['top_set'],
+            'e1rm': round(p['e1rm'], 2)
+        }
+        async for p in db.workouts.aggregate(pipeline)
+        if parse_day(p['_id'])  # dates stored before they were validated can't be placed on the trend
+    ]
+    if not points:
+        return {'exercise': exercise_name, 'sessions': 0, 'summary': None, 'points': []}
+
+    volumes = [p['volume'] for p in points]
+    e1rms = [p['e1rm'] for p in points]
+    for p, volume_avg, e1rm_avg in zip(points, rolling_mean(volumes, window), rolling_mean(e1rms, window)):
+        p['volume_avg'] = round(volume_avg, 2)
+        p['e1rm_avg'] = round(e1rm_avg, 2)
+
+    days = [parse_day(p['date']).toordinal() for p in points]
+    e1rm_slope = trend_slope(days, e1rms)
+    volume_slope = trend_slope(days, volumes)
+    best = max(points, key=lambda p: p['e1rm'])
+    return {
+        'exercise': exercise_name,
+        'sessions': len(points),
+        'summary': {
+            'total_volume': sum(volumes),
+            'best_e1rm': best['e1rm'],
+            'best_e1rm_date': best['date'],
+            'top_set': max((p['top_set'] for p in points), key=lambda t: (t['weight'], t['reps'])),
+            'e1rm_trend_per_week': round(e1rm_slope * 7, 2) if e1rm_slope is not None else None,
+            'volume_trend_per_week': round(volume_slope * 7, 2) if volume_slope is not None else None
+        },
+        'points': points
+    }
+
+# Personal records
+# One document per user and exercise (_id '<user>:<exercise name>'). Inserts
+# raise records with a conditional pipeline update; updates/deletes recompute
+# the affected exercises.
+RECORD_FIELDS = ('max_weight', 'max_volume', 'best_e1rm')
+
+def weight_key(weight):
+    return f'{weight:g}'.replace('.', '_')
+
+def offer_set(best, reps, weight, workout_id, day):
+    source = {'reps': reps, 'weight': weight, 'workout_id': workout_id, 'date': day}
+    for field, value in (
+        ('max_weight', weight),
+        ('max_volume', reps * weight),
+        ('best_e1rm', round(estimate_1rm(weight, reps), 2))
+    ):
+        if field not in best or value > best[field]['value']:
+            best[field] = {'value': value, **source}
+    key = weight_key(weight)
+    if key not in best['reps_at_weight'] or reps > best['reps_at_weight'][key]['reps']:
+        best['reps_at_weight'][key] = source
+
+def record_candidates(workouts):
+    candidates = {}
+    for w in workouts:
+        for exercise in w.get('exercises', []):
+            for s in exercise.get('sets', []):
+                if not is_lifted_set(s):
+                    continue
+                best = candidates.setdefault(exercise['name'], {'reps_at_weight': {}})
+                offer_set(best, s['reps'], s['weight'], str(w['_id']), w['date'])
+    return candidates
+
+def record_improvements(exercise, before, after):
+    before = before or {}
+    improved = []
+    for field in RECORD_FIELDS:
+        new = after.get(field)
+        old = before.get(field)
+        if new and (old is None or new['value'] > old['value']):
+            improved.append({
+                'exercise': exercise, 'record': field, 'value': new['value'],
+                'previous': old['value'] if old else None
+            })
+    return improved
+
+def keep_better(path, candidate, compare='value'):
+    return {'$cond': [
+        {'$gt': [candidate[compare], {'$ifNull': [f'${path}.{compare}', -1]}]},
+        {'$literal': candidate},
+        f'${path}'
+    ]}
+
+async def update_personal_records(user_id, workouts):
+    new_records = []
+    for exercise, best in record_candidates(workouts).items():
+        stage = {field: keep_better(field, best[field]) for field in RECORD_FIELDS}
+        stage['user_id'] = user_id
+        stage['exercise'] = exercise
+        stage['reps_at_weight'] = {'$mergeObjects': [
+            {'$ifNull': ['$reps_at_weight', {}]},
+            {key: keep_better(f'reps_at_weight.{key}', c, 'reps') for key, c in best['reps_at_weight'].items()}
+        ]}
+        before = await db.personal_records.find_one_and_update(
+            {'_id': user_key(user_id, exercise)}, [{'$set': stage}], upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        new_records.extend(record_improvements(exercise, before, best))
+    return new_records
+
+async def recompute_personal_records(user_id, exercise_names):
+    new_records = []
+    for exercise in exercise_names:
+        best = {'reps_at_weight': {}}
+        pipeline = [
+            {'$match': {'user_id': user_id, 'exercises.name': exercise}},
+            {'$project': {'date': 1, 'exercises': 1}},
+            DECODE_SETS_STAGE,
+            {'$unwind': '$exercises'},
+            {'$match': {'exercises.name': exercise}},
+            {'$unwind': '$exercises.sets'},
+            LIFTED_SET_MATCH,
+            {'$project': {'date': 1, 'reps': '$exercises.sets.reps', 'weight': '$exercises.sets.weight'}}
+        ]
+        async for s in db.workouts.aggregate(pipeline):
+            offer_set(best, s['reps'], s['weight'], str(s['_id']), s['date'])
+        if len(best) == 1:
+            await db.personal_records.delete_one({'_id': user_key(user_id, exercise)})
+            continue
+        before = await db.personal_records.find_one_and_replace(
+            {'_id': user_key(user_id, exercise)}, {'user_id': user_id, 'exercise': exercise, **best}, upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        new_records.extend(record_improvements(exercise, before, best))
+    return new_records
+
+async def rebuild_personal_records(user_id):
+    names = await db.workouts.distinct('exercises.name', {'user_id': user_id})
+    await db.personal_records.delete_many({'user_id': user_id, 'exercise': {'$nin': names}})
+    await recompute_personal_records(user_id, names)
+
+def format_record(doc):
+    # Keyed by exercise name in the API, as before records were per user
+    doc['_id'] = doc['exercise']
+    doc.pop('user_id', None)
+    doc['reps_at_weight'] = sorted(doc.get('reps_at_weight', {}).values(), key=lambda r: r['weight'])
+    return doc
+
+# Partial workout updates
+# Positional updates touch only the changed exercise/set. The pre-image returned
+# by find_one_and_update has the same change applied locally to build the
+# response, so each edit is a single round-trip.
+def parse_object_id(value):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid workout id")
+
+async def patch_workout(user_id, workout_id, match, update, apply):
+    before, stamp = await modify_workout(user_id, parse_object_id(workout_id), match, update)
+    if before is None:
+        raise HTTPException(status_code=404, detail="Workout, exercise or set not found")
+    after = copy.deepcopy(before)
+    apply(after)
+    after['updated_at'] = stamp['updated_at'].isoformat()
+    return before, after
+
+async def record_exercise_patch(user_id, after, names, lowered):
+    response_cache.invalidate(*user_tags(user_id, 'workouts'))
+    try:
+        if lowered:
+            return await recompute_personal_records(user_id, names)
+        changed = [e for e in after['exercises'] if e['name'] in names]
+        return await update_personal_records(user_id, [{**after, 'exercises': changed}])
+    finally:
+        await invalidate_cached(user_id, 'workouts')
+
+def without_index(array_expr, index):
+    return {'$concatArrays': [
+        {'$slice': [array_expr, index]},
+        {'$slice': [array_expr, index + 1, {'$max': [1, {'$size': array_expr}]}]}
+    ]}
+
+def map_exercise(index, expr):
+    # Pipeline expression rebuilding exercises with expr(e) applied at `index`
+    return {'$map': {
+        'input': {'$range': [0, {'$size': '$exercises'}]},
+        'as': 'i',
+        'in': {'$let': {
+            'vars': {'e': {'$arrayElemAt': ['$exercises', '$$i']}},
+            'in': {'$cond': [{'$eq': ['$$i', index]}, expr('$$e'), '$$e']}
+        }}
+    }}
+
+def patched_response(after, new_records):
+    return serialize_doc({**after, 'new_records': new_records})
+
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "Fitness Tracking API"}
 
+@api_router.get("/health/ready")
+async def readiness(request: Request):
+    # 503 until startup has finished, while MongoDB doesn't answer, and while the
+    # pool is saturated with requests queued for a connection
+    checks = {'startup': request.app.state.ready}
+    if client is not None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(client.admin.command('ping'), HEALTH_PING_TIMEOUT)
+            checks['mongo'] = True
+            checks['mongo_ping_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:
+            checks['mongo'] = False
+            checks['mongo_error'] = str(e)
+    else:
+        checks['mongo'] = False
+    pool = mongo_pool_metrics.snapshot()
+    max_size = mongo_settings['maxPoolSize']
+    # maxPoolSize 0 means the driver doesn't cap the pool
+    saturation = pool['in_use'] / max_size if max_size else 0.0
+    pool.update(max_size=max_size, saturation=round(saturation, 3))
+    checks['pool'] = not (pool['waiting'] > 0 and saturation >= MONGO_READY_MAX_SATURATION)
+    ready = checks['startup'] and checks['mongo'] and checks['pool']
+    return ORJSONResponse(
+        {'status': 'ready' if ready else 'not_ready', 'checks': checks, 'pool': pool},
+        status_code=200 if ready else 503
+    )
+
 # Workout endpoints
 @api_router.post("/workouts")
-async def create_workout(workout: WorkoutCreate):
+async def create_workout(workout: WorkoutCreate, user_id: str = Depends(current_user)):
     workout_dict = workout.model_dump()
     workout_dict['created_at'] = datetime.utcnow().isoformat()
-    result = await db.workouts.insert_one(workout_dict)
-    workout_dict['_id'] = str(result.inserted_id)
+    async with change_stamps(user_id) as (stamp,):
+        result = await db.workouts.insert_one({**encode_workout({**workout_dict, 'user_id': user_id}), **stamp})
+    workout_dict['_id'] = result.inserted_id
+    workout_dict['updated_at'] = stamp['updated_at'].isoformat()
+    new_records = await record_workout_changes(user_id, added=[workout_dict])
+    workout_dict['new_records'] = new_records
     return serialize_doc(workout_dict)
 
+async def insert_workouts(user_id, docs):
+    # Unordered insert of API-shape workouts that already have an _id; returns
+    # {position: error} for the ones that failed
+    if not docs:
+        return {}
+    async with change_stamps(user_id, len(docs)) as stamps:
+        try:
+            await db.workouts.insert_many(
+                [{**encode_workout({**d, 'user_id': user_id}), **stamp} for d, stamp in zip(docs, stamps)],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            return {err['index']: err['errmsg'] for err in e.details['writeErrors']}
+    return {}
+
+@api_router.post("/workouts/bulk")
+async def create_workouts_bulk(request: Request, user_id: str = Depends(current_user)):
+    valid, results = await parse_bulk_items(request, WorkoutCreate)
+    created_at = datetime.utcnow().isoformat()
+    docs = []
+    for _, workout in valid:
+        workout_dict = workout.model_dump()
+        workout_dict['created_at'] = created_at
+        workout_dict['_id'] = ObjectId()
+        docs.append(workout_dict)
+
+    write_errors = await insert_workouts(user_id, docs)
+
+    inserted = []
+    for pos, ((index, _), doc) in enumerate(zip(valid, docs)):
+        if pos in write_errors:
+            results.append({'index': index, 'status': 'error', 'error': write_errors[pos]})
+        else:
+            inserted.append(doc)
+            results.append({'index': index, 'status': 'created', '_id': str(doc['_id'])})
+    report = bulk_report(results, 'created')
+    report['new_records'] = await record_workout_changes(user_id, added=inserted)
+    return report
+
 @api_router.get("/workouts")
-async def get_workouts(start_date: Optional[str] = None, end_date: Optional[str] = None):
-    query = {}
-    if start_date and end_date:
-        query['date'] = {'$gte': start_date, '$lte': end_date}
-    
-    workouts = await db.workouts.find(query).sort('date', -1).to_list(100)
-    return [serialize_doc(w) for w in workouts]
+async def get_workouts(
+    request: Request,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    format: str = Query('json', pattern='^(json|ndjson)$'),
+    fields: Optional[str] = None,
+    view: str = Query('full', pattern='^(full|summary)$'),
+    user_id: str = Depends(current_user)
+):
+    query = {'user_id': user_id, **date_range_query(start_date, end_date)}
+    projection = workout_projection(fields, view)
+    decode = workout_decoder(projection)
+    if format == 'ndjson':
+        return stream_ndjson('workouts', query, cursor, limit, projection, decode)
+    return await cached_json(
+        request, user_tags(user_id, 'workouts'),
+        lambda: paginate('workouts', query, cursor, limit or 100, projection, decode), user_id=user_id
+    )
+
+@api_router.get("/workouts/series")
+async def get_workout_series(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    granularity: str = Query('day', pattern='^(day|week|month)$'),
+    user_id: str = Depends(current_user)
+):
+    end = parse_date(end_date, 'end_date') if end_date else date.today()
+    start = parse_date(start_date, 'start_date') if start_date else end - timedelta(days=6)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    if (end - start).days >= MAX_SERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Date range is limited to {MAX_SERIES_BUCKETS} days")
+
+    return {
+        'granularity': granularity,
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'buckets': await compute_workout_series(user_id, start, end, granularity)
+    }
 
 @api_router.get("/workouts/{workout_id}")
-async def get_workout(workout_id: str):
+async def get_workout(workout_id: str, user_id: str = Depends(current_user)):
     try:
-        workout = await db.workouts.find_one({'_id': ObjectId(workout_id)})
+        workout = await db.workouts.find_one({'_id': ObjectId(workout_id), 'user_id': user_id})
         if not workout:
             raise HTTPException(status_code=404, detail="Workout not found")
-        return serialize_doc(workout)
+        return serialize_doc(decode_workout(workout))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @api_router.put("/workouts/{workout_id}")
-async def update_workout(workout_id: str, workout: WorkoutCreate):
+async def update_workout(workout_id: str, workout: WorkoutCreate, user_id: str = Depends(current_user)):
     try:
         workout_dict = workout.model_dump()
-        result = await db.workouts.update_one(
-            {'_id': ObjectId(workout_id)},
-            {'$set': workout_dict}
-        )
-        if result.matched_count == 0:
+        encoded = encode_workout(workout_dict)
+        update = {'$set': encoded}
+        omitted = {field: '' for field in ('duration', 'notes') if field not in encoded}
+        if omitted:
+            update['$unset'] = omitted
+        previous, stamp = await modify_workout(user_id, ObjectId(workout_id), {}, update)
+        if previous is None:
             raise HTTPException(status_code=404, detail="Workout not found")
-        
-        updated_workout = await db.workouts.find_one({'_id': ObjectId(workout_id)})
-        return serialize_doc(updated_workout)
+
+        new_records = await record_workout_changes(user_id, added=[workout_dict], removed=[previous])
+        workout_dict['updated_at'] = stamp['updated_at'].isoformat()
+        return serialize_doc({**previous, **workout_dict, 'new_records': new_records})
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @api_router.delete("/workouts/{workout_id}")
-async def delete_workout(workout_id: str):
+async def delete_workout(workout_id: str, user_id: str = Depends(current_user)):
     try:
-        result = await db.workouts.delete_one({'_id': ObjectId(workout_id)})
-        if result.deleted_count == 0:
-            raise HTTPException(status_code=404, detail="Workout not found")
+        async with change_stamps(user_id) as (stamp,):
+            deleted = await db.workouts.find_one_and_delete(
+                {'_id': ObjectId(workout_id), 'user_id': user_id},
+                projection={'date': 1, 'duration': 1, 'exercises.name': 1}
+            )
+            if deleted is None:
+                raise HTTPException(status_code=404, detail="Workout not found")
+            await add_tombstone(user_id, 'workouts', str(deleted['_id']), stamp)
+        await record_workout_changes(user_id, removed=[deleted])
         return {"message": "Workout deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@api_router.post("/workouts/{workout_id}/exercises")
+async def add_exercise(workout_id: str, exercise: Exercise, user_id: str = Depends(current_user)):
+    exercise_dict = exercise.model_dump()
+    _, after = await patch_workout(
+        user_id, workout_id, {}, {'$push': {'exercises': encode_exercise(exercise_dict)}},
+        lambda w: w['exercises'].append(exercise_dict)
+    )
+    return patched_response(after, await record_exercise_patch(user_id, after, {exercise.name}, lowered=False))
+
+@api_router.patch("/workouts/{workout_id}/exercises/{exercise_index}")
+async def update_exercise(
+    workout_id: str,
+    patch: ExercisePatch,
+    exercise_index: int = PathParam(ge=0),
+    user_id: str = Depends(current_user)
+):
+    changes = patch.model_dump(exclude_none=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    before, after = await patch_workout(
+        user_id, workout_id,
+        {f'exercises.{exercise_index}': {'$exists': True}},
+        {'$set': {f'exercises.{exercise_index}.{k}': v for k, v in changes.items()}},
+        lambda w: w['exercises'][exercise_index].update(changes)
+    )
+    new_records = []
+    old_name = before['exercises'][exercise_index]['name']
+    if 'name' in changes and changes['name'] != old_name:
+        # A rename moves the sets' records from one exercise to another
+        new_records = await record_exercise_patch(user_id, after, {old_name, changes['name']}, lowered=True)
+    else:
+        response_cache.invalidate(*user_tags(user_id, 'workouts'))
+    return patched_response(after, new_records)
+
+@api_router.delete("/workouts/{workout_id}/exercises/{exercise_index}")
+async def remove_exercise(workout_id: str, exercise_index: int = PathParam(ge=0), user_id: str = Depends(current_user)):
+    before, after = await patch_workout(
+        user_id, workout_id,
+        {f'exercises.{exercise_index}': {'$exists': True}},
+        [{'$set': {'exercises': without_index('$exercises', exercise_index)}}],
+        lambda w: w['exercises'].pop(exercise_index)
+    )
+    name = before['exercises'][exercise_index]['name']
+    return patched_response(after, await record_exercise_patch(user_id, after, {name}, lowered=True))
+
+@api_router.post("/workouts/{workout_id}/exercises/{exercise_index}/sets")
+async def add_set(
+    workout_id: str,
+    exercise_set: ExerciseSet,
+    exercise_index: int = PathParam(ge=0),
+    user_id: str = Depends(current_user)
+):
+    set_dict = exercise_set.model_dump()
+    prefix = f'exercises.{exercise_index}'
+    weight = compact_number(set_dict['weight'])
+    if set_dict['completed']:
+        update = {'$push': {f'{prefix}.reps': set_dict['reps'], f'{prefix}.weight': weight}}
+    else:
+        # The new set's skipped bit sits at the current set count
+        update = [{'$set': {'exercises': map_exercise(exercise_index, lambda e: {'$mergeObjects': [e, {
+            'reps': {'$concatArrays': [f'{e}.reps', [set_dict['reps']]]},
+            'weight': {'$concatArrays': [f'{e}.weight', [weight]]},
+            'skipped': {'$add': [{'$ifNull': [f'{e}.skipped', 0]}, {'$pow': [2, {'$size': f'{e}.reps'}]}]}
+        }]})}}]
+    _, after = await patch_workout(
+        user_id, workout_id,
+        {prefix: {'$exists': True}, f'{prefix}.reps.{MAX_SETS_PER_EXERCISE - 1}': {'$exists': False}},
+        update,
+        lambda w: w['exercises'][exercise_index]['sets'].append(set_dict)
+    )
+    name = after['exercises'][exercise_index]['name']
+    return patched_response(after, await record_exercise_patch(user_id, after, {name}, lowered=False))
+
+@api_router.patch("/workouts/{workout_id}/exercises/{exercise_index}/sets/{set_index}")
+async def update_set(
+    workout_id: str,
+    patch: ExerciseSetPatch,
+    exercise_index: int = PathParam(ge=0),
+    set_index: int = PathParam(ge=0),
+    user_id: str = Depends(current_user)
+):
+    changes = patch.model_dump(exclude_none=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    prefix = f'exercises.{exercise_index}'
+    update = {}
+    for field in ('reps', 'weight'):
+        if field in changes:
+            update.setdefault('$set', {})[f'{prefix}.{field}.{set_index}'] = compact_number(changes[field])
+    if 'completed' in changes:
+        bit = 1 << set_index
+        update['$bit'] = {f'{prefix}.skipped': {'and': ~bit} if changes['completed'] else {'or': bit}}
+    before, after = await patch_workout(
+        user_id, workout_id,
+        {f'{prefix}.reps.{set_index}': {'$exists': True}},
+        update,
+        lambda w: w['exercises'][exercise_index]['sets'][set_index].update(changes)
+    )
+    old = before['exercises'][exercise_index]['sets'][set_index]
+    new = after['exercises'][exercise_index]['sets'][set_index]
+    lowered = (
+        new['reps'] < old['reps'] or new['weight'] < old['weight']
+        or (old.get('completed') is not False and new.get('completed') is False)
+    )
+    name = after['exercises'][exercise_index]['name']
+    return patched_response(after, await record_exercise_patch(user_id, after, {name}, lowered))
+
+@api_router.delete("/workouts/{workout_id}/exercises/{exercise_index}/sets/{set_index}")
+async def remove_set(
+    workout_id: str,
+    exercise_index: int = PathParam(ge=0),
+    set_index: int = PathParam(ge=0),
+    user_id: str = Depends(current_user)
+):
+    def drop_set(e):
+        mask = {'$ifNull': [f'{e}.skipped', 0]}
+        # Bits below the removed set stay, bits above it shift down by one
+        below = {'$mod': [mask, 2 ** set_index]}
+        above = {'$multiply': [{'$floor': {'$divide': [mask, 2 ** (set_index + 1)]}}, 2 ** set_index]}
+        return {'$mergeObjects': [e, {
+            'reps': without_index(f'{e}.reps', set_index),
+            'weight': without_index(f'{e}.weight', set_index),
+            'skipped': {'$toLong': {'$add': [below, above]}}
+        }]}
+
+    before, after = await patch_workout(
+        user_id, workout_id,
+        {f'exercises.{exercise_index}.reps.{set_index}': {'$exists': True}},
+        [{'$set': {'exercises': map_exercise(exercise_index, drop_set)}}],
+        lambda w: w['exercises'][exercise_index]['sets'].pop(set_index)
+    )
+    name = before['exercises'][exercise_index]['name']
+    return patched_response(after, await record_exercise_patch(user_id, after, {name}, lowered=True))
+
 # Stats endpoint
 @api_router.get("/workouts/stats/summary")
-async def get_workout_stats():
-    from datetime import timedelta
-    
+async def get_workout_stats(request: Request, user_id: str = Depends(current_user)):
+    async def summary():
+        timings = {}
+        stats = await compute_workout_stats(user_id, timings)
+        return stats, {'Server-Timing': server_timing(timings)}
+    # Keyed on today's date too, since the week/month windows and steps move with it
+    return await cached_json(
+        request, user_tags(user_id, 'workouts', 'steps'), summary, key_extra=(date.today(),), timeout=5,
+        user_id=user_id
+    )
+
+async def rollup_totals(user_id):
+    key = user_key(user_id, ROLLUP_TOTALS_ID)
+    return await db.workout_rollups.find_one({'_id': key}) or {}
+
+async def recent_workout_counts(user_id, week_ago, month_ago):
+    # At most ~31 day buckets (plus any future-dated ones), whatever the history size
+    workouts_this_week = workouts_this_month = 0
+    buckets = db.workout_rollups.find({'user_id': user_id, 'date': {'$gte': month_ago.isoformat()}})
+    async for bucket in buckets:
+        workouts_this_month += bucket.get('workouts', 0)
+        if bucket['date'] >= week_ago.isoformat():
+            workouts_this_week += bucket.get('workouts', 0)
+    return workouts_this_week, workouts_this_month
+
+async def steps_on(user_id, day):
+    step_log = await db.steps.find_one({'user_id': user_id, 'date': day.isoformat()})
+    return step_log.get('steps', 0) if step_log else 0
+
+async def compute_workout_stats(user_id, timings=None):
     today = date.today()
     week_ago = today - timedelta(days=7)
     month_ago = today - timedelta(days=30)
-    
-    # Total workouts
-    total_workouts = await db.workouts.count_documents({})
-    
-    # Workouts this week
-    workouts_this_week = await db.workouts.count_documents({
-        'date': {'$gte': week_ago.isoformat()}
-    })
-    
-    # Workouts this month
-    workouts_this_month = await db.workouts.count_documents({
-        'date': {'$gte': month_ago.isoformat()}
-    })
-    
-    # Total duration
-    workouts = await db.workouts.find({'duration': {'$exists': True}}).to_list(1000)
-    total_duration = sum(w.get('duration', 0) for w in workouts)
-    
-    # Steps today
-    step_log = await db.steps.find_one({'date': today.isoformat()})
-    total_steps_today = step_log.get('steps', 0) if step_log else 0
-    
+
+    # Independent reads, issued concurrently
+    totals, (workouts_this_week, workouts_this_month), total_steps_today = await asyncio.gather(
+        timed(timings, 'stats_totals', rollup_totals(user_id)),
+        timed(timings, 'stats_buckets', recent_workout_counts(user_id, week_ago, month_ago)),
+        timed(timings, 'stats_steps', steps_on(user_id, today))
+    )
+
     return {
-        'total_workouts': total_workouts,
-        'total_duration': total_duration,
+        'total_workouts': totals.get('total_workouts', 0),
+        'total_duration': totals.get('total_duration', 0),
         'workouts_this_week': workouts_this_week,
         'workouts_this_month': workouts_this_month,
         'total_steps_today': total_steps_today
     }
 
-# Exercise library
+# Dashboard
+# Everything the app shows on open in one response; the sections are independent
+# and fetched concurrently
+@api_router.get("/dashboard")
+async def get_dashboard(
+    request: Request,
+    limit: int = Query(10, ge=1, le=100),
+    view: str = Query('summary', pattern='^(full|summary)$'),
+    user_id: str = Depends(current_user)
+):
+    async def dashboard():
+        today = date.today()
+        projection = workout_projection(None, view)
+        timings = {}
+        started = time.perf_counter()
+        (recent, _), stats, series = await asyncio.gather(
+            timed(timings, 'workouts', paginate(
+                'workouts', {'user_id': user_id}, None, limit, projection, workout_decoder(projection)
+            )),
+            timed(timings, 'stats', compute_workout_stats(user_id, timings)),
+            timed(timings, 'series', compute_workout_series(user_id, today - timedelta(days=6), today, 'day'))
+        )
+        timings['total'] = (time.perf_counter() - started) * 1000
+        data = {
+            'recent_workouts': recent,
+            'stats': stats,
+            'steps_today': {'date': today.isoformat(), 'steps': stats['total_steps_today']},
+            'series': series
+        }
+        # Cached along with the body, so a cache hit reports the timings of the
+        # computation that produced it
+        return data, {'Server-Timing': server_timing(timings)}
+    return await cached_json(
+        request, user_tags(user_id, 'workouts', 'steps'), dashboard, key_extra=(date.today(),), timeout=5,
+        user_id=user_id
+    )
+
+# Exercise catalog
 @api_router.get("/exercises")
-async def get_exercises():
-    return EXERCISE_LIBRARY
+async def get_exercises(
+    request: Request,
+    category: Optional[str] = None,
+    equipment: Optional[str] = None,
+    muscle: Optional[str] = None
+):
+    async def listing():
+        allowed = exercise_catalog.filtered({'category': category, 'equipment': equipment, 'muscle': muscle})
+        if allowed is None:
+            return exercise_catalog.exercises, {}
+        return [e for i, e in enumerate(exercise_catalog.exercises) if i in allowed], {}
+    return await cached_json(
+        request, ('exercises',), listing, cache=catalog_responses, cache_control='public, max-age=3600'
+    )
+
+@api_router.get("/exercises/search")
+async def search_exercises(
+    request: Request,
+    q: str = '',
+    category: Optional[str] = None,
+    equipment: Optional[str] = None,
+    muscle: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    async def results():
+        return exercise_catalog.search(q, limit, category=category, equipment=equipment, muscle=muscle), {}
+    return await cached_json(
+        request, ('exercises',), results, cache=catalog_responses, cache_control='public, max-age=3600'
+    )
+
+@api_router.get("/exercises/{exercise_name}/progression")
+async def get_exercise_progression(
+    exercise_name: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    window: int = Query(5, ge=1, le=100),
+    user_id: str = Depends(current_user)
+):
+    return await compute_exercise_progression(
+        exercise_name, {'user_id': user_id, **date_range_query(start_date, end_date)}, window
+    )
+
+# Personal records
+@api_router.get("/records")
+async def get_personal_records(user_id: str = Depends(current_user)):
+    records = await db.personal_records.find({'user_id': user_id}).sort('exercise', 1).to_list(None)
+    return [format_record(r) for r in records]
+
+@api_router.get("/records/{exercise_name}")
+async def get_personal_record(exercise_name: str, user_id: str = Depends(current_user)):
+    record = await db.personal_records.find_one({'_id': user_key(user_id, exercise_name)})
+    if not record:
+        raise HTTPException(status_code=404, detail="No records for this exercise")
+    return format_record(record)
+
+# Step rollups
+# Pedometer samples are added with $inc into hourly buckets (step_hours, _id
+# '<user>:YYYY-MM-DDTHH') and into the daily `steps` documents. step_weeks keeps
+# a total per week (_id: '<user>:<Monday>') from every change to a daily total. A
+# MongoDB time-series collection would not take $inc updates, hence plain
+# bucket documents. Hourly buckets only reflect samples; POST /steps still sets
+# a day's total outright.
+MAX_STEP_HOUR_DAYS = 31
+
+async def upsert_increments(collection, updates):
+    # Unordered upserts of [(filter, update)]; ops that lost the insert race to a
+    # concurrent upsert of the same key are retried as plain updates
+    if not updates:
+        return
+    try:
+        await db[collection].bulk_write([UpdateOne(f, u, upsert=True) for f, u in updates], ordered=False)
+    except BulkWriteError as e:
+        errors = e.details['writeErrors']
+        if any(err['code'] != 11000 for err in errors):
+            raise
+        await db[collection].bulk_write([UpdateOne(*updates[err['index']]) for err in errors], ordered=False)
+
+async def apply_step_week_deltas(user_id, day_deltas):
+    weeks = {}
+    for day, delta in day_deltas.items():
+        day = parse_day(day)
+        if day is None:
+            continue  # not in any week; rebuild_step_weeks leaves it out too
+        week = series_period(day, 'week')
+        weeks[week] = weeks.get(week, 0) + delta
+    await upsert_increments('step_weeks', [
+        ({'_id': user_key(user_id, w)}, {'$inc': {'steps': d}}) for w, d in weeks.items() if d
+    ])
+
+async def rebuild_step_weeks(user_id):
+    # Recomputes the user's weeks from their daily totals; idempotent
+    pipeline = [
+        {'$match': {'user_id': user_id}},
+        {'$group': {'_id': series_period_expr('week'), 'steps': {'$sum': '$steps'}}},
+        {'$match': {'_id': {'$type': 'string'}}}  # days that don't parse group under null
+    ]
+    weeks = await db.steps.aggregate(pipeline).to_list(None)
+    await db.step_weeks.delete_many({'_id': user_key_range(user_id)})
+    if weeks:
+        await db.step_weeks.insert_many([{**w, '_id': user_key(user_id, w['_id'])} for w in weeks])
+
+async def record_step_samples(user_id, samples):
+    hours, days = {}, {}
+    for sample in samples:
+        hour = sample.timestamp.strftime('%Y-%m-%dT%H')
+        bucket = hours.setdefault(hour, [0, 0])
+        bucket[0] += sample.steps
+        bucket[1] += 1
+        days[hour[:10]] = days.get(hour[:10], 0) + sample.steps
+    await upsert_increments('step_hours', [
+        ({'_id': user_key(user_id, hour)}, {'$inc': {'steps': steps, 'samples': count}})
+        for hour, (steps, count) in hours.items()
+    ])
+    async with change_stamps(user_id, len(days)) as stamps:
+        await upsert_increments('steps', [
+            ({'user_id': user_id, 'date': day}, {'$inc': {'steps': steps}, '$set': stamp})
+            for (day, steps), stamp in zip(days.items(), stamps)
+        ])
+    await apply_step_week_deltas(user_id, days)
+    totals = {
+        d['date']: d.get('steps', 0)
+        async for d in db.steps.find({'user_id': user_id, 'date': {'$in': list(days)}}, {'date': 1, 'steps': 1})
+    }
+    await set_activity(user_id, 'steps', {day: totals.get(day, 0) >= ACTIVITY_MIN_STEPS for day in days})
+    await invalidate_cached(user_id, 'steps')
+
+async def compute_step_buckets(user_id, granularity, start, end):
+    if granularity == 'hour':
+        collection, low, high = 'step_hours', start.isoformat(), f'{end.isoformat()}T23'
+    else:
+        collection, low, high = 'step_weeks', series_period(start, 'week'), end.isoformat()
+    query = {'_id': {'$gte': user_key(user_id, low), '$lte': user_key(user_id, high)}}
+    docs = await db[collection].find(query).sort('_id', -1).to_list(None)
+    prefix = len(user_key(user_id, ''))
+    return [{granularity: d['_id'][prefix:], 'steps': d['steps']} for d in docs], {}
+
+async def write_daily_steps(user_id, entries):
+    # Sets [(day, steps)], one entry per day, in one bulk write; returns
+    # {position: error} for the entries that failed
+    # Pre-images for the weekly rollup; a concurrent write to one of these days
+    # in between can leave its week off until rebuild_step_weeks()
+    previous = {
+        d['date']: d.get('steps', 0)
+        async for d in db.steps.find(
+            {'user_id': user_id, 'date': {'$in': [day for day, _ in entries]}}, {'date': 1, 'steps': 1}
+        )
+    }
+    write_errors = {}
+    async with change_stamps(user_id, len(entries)) as stamps:
+        ops = [
+            UpdateOne({'user_id': user_id, 'date': day}, {'$set': {'steps': steps, **stamp}}, upsert=True)
+            for (day, steps), stamp in zip(entries, stamps)
+        ]
+        try:
+            await db.steps.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            write_errors = {err['index']: err['errmsg'] for err in e.details['writeErrors']}
+    await apply_step_week_deltas(user_id, {
+        day: steps - previous.get(day, 0)
+        for pos, (day, steps) in enumerate(entries) if pos not in write_errors
+    })
+    await set_activity(user_id, 'steps', {
+        day: steps >= ACTIVITY_MIN_STEPS for pos, (day, steps) in enumerate(entries) if pos not in write_errors
+    })
+    await invalidate_cached(user_id, 'steps')
+    return write_errors
+
+async def flush_step_logs(batch):
+    # Buffered under (user_id, day); one bulk write per user
+    by_user = {}
+    for (user_id, day), steps in batch.items():
+        by_user.setdefault(user_id, []).append((day, steps))
+    for user_id, entries in by_user.items():
+        write_errors = await write_daily_steps(user_id, entries)
+        for pos, error in write_errors.items():
+            logger.error(f"Dropped buffered steps for {user_id} on {entries[pos][0]}: {error}")
+
+# POST /steps is write-behind: a device pushing its running total every few
+# seconds costs one bulk write per flush interval, and reads see it after at
+# most STEP_FLUSH_INTERVAL_SECONDS
+step_log_buffer = WriteBehindBuffer(
+    flush_step_logs,
+    max_entries=int(os.environ.get('STEP_FLUSH_MAX_DAYS', 500)),
+    interval=float(os.environ.get('STEP_FLUSH_INTERVAL_SECONDS', 1))
+)
 
 # Step tracking
+STEP_PROJECTION = {'seq': 0, 'user_id': 0}
+
 @api_router.post("/steps")
-async def log_steps(step_log: StepLog):
-    result = await db.steps.update_one(
-        {'date': step_log.date},
-        {'$set': {'steps': step_log.steps}},
-        upsert=True
-    )
+async def log_steps(step_log: StepLog, user_id: str = Depends(current_user)):
+    try:
+        await step_log_buffer.put((user_id, step_log.date), step_log.steps)
+    except BufferFull:
+        raise HTTPException(
+            status_code=503, detail="Step writes are backed up; retry later",
+            headers={'Retry-After': str(max(1, round(step_log_buffer.interval)))}
+        )
     return {"message": "Steps logged successfully", "steps": step_log.steps}
 
+@api_router.post("/steps/bulk")
+async def log_steps_bulk(request: Request, user_id: str = Depends(current_user)):
+    valid, results = await parse_bulk_items(request, StepLog)
+    # Last entry wins for a day repeated within one payload
+    latest = {}
+    for index, step_log in valid:
+        if step_log.date in latest:
+            results.append({'index': latest[step_log.date][0], 'status': 'superseded'})
+        latest[step_log.date] = (index, step_log)
+
+    entries = list(latest.values())
+    write_errors = {}
+    if entries:
+        # Older than this request, so buffered single-day logs must not land after it
+        for _, s in entries:
+            step_log_buffer.discard((user_id, s.date))
+        write_errors = await write_daily_steps(user_id, [(s.date, s.steps) for _, s in entries])
+
+    for pos, (index, step_log) in enumerate(entries):
+        if pos in write_errors:
+            results.append({'index': index, 'status': 'error', 'error': write_errors[pos]})
+        else:
+            results.append({'index': index, 'status': 'logged', 'date': step_log.date, 'steps': step_log.steps})
+    return bulk_report(results, 'logged')
+
+@api_router.post("/steps/samples")
+async def log_step_samples(request: Request, user_id: str = Depends(current_user)):
+    valid, results = await parse_bulk_items(request, StepSample)
+    if valid:
+        await record_step_samples(user_id, [sample for _, sample in valid])
+    results.extend({'index': index, 'status': 'recorded'} for index, _ in valid)
+    return bulk_report(results, 'recorded')
+
 @api_router.get("/steps")
-async def get_steps(start_date: Optional[str] = None, end_date: Optional[str] = None):
-    query = {}
-    if start_date and end_date:
-        query['date'] = {'$gte': start_date, '$lte': end_date}
-    
-    steps = await db.steps.find(query).sort('date', -1).to_list(100)
-    return [serialize_doc(s) for s in steps]
+async def get_steps(
+    request: Request,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    format: str = Query('json', pattern='^(json|ndjson)$'),
+    granularity: str = Query('day', pattern='^(hour|day|week)$'),
+    user_id: str = Depends(current_user)
+):
+    if granularity != 'day':
+        # Bounded by the date range rather than paginated
+        if cursor or format == 'ndjson':
+            raise HTTPException(status_code=400, detail="cursor and ndjson require granularity=day")
+        end = parse_date(end_date, 'end_date') if end_date else date.today()
+        start = parse_date(start_date, 'start_date') if start_date else end - timedelta(days=0 if granularity == 'hour' else 83)
+        max_days = MAX_STEP_HOUR_DAYS if granularity == 'hour' else MAX_SERIES_BUCKETS
+        if start > end:
+            raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+        if (end - start).days >= max_days:
+            raise HTTPException(status_code=400, detail=f"Date range is limited to {max_days} days")
+        return await cached_json(
+            request, user_tags(user_id, 'steps'), lambda: compute_step_buckets(user_id, granularity, start, end),
+            user_id=user_id
+        )
+
+    query = {'user_id': user_id, **date_range_query(start_date, end_date)}
+    if format == 'ndjson':
+        return stream_ndjson('steps', query, cursor, limit, STEP_PROJECTION)
+    return await cached_json(
+        request, user_tags(user_id, 'steps'),
+        lambda: paginate('steps', query, cursor, limit or 100, STEP_PROJECTION), user_id=user_id
+    )
+
+@api_router.delete("/steps/{day}")
+async def delete_steps(day: str, user_id: str = Depends(current_user)):
+    buffered = step_log_buffer.discard((user_id, day))
+    async with change_stamps(user_id) as (stamp,):
+        deleted = await db.steps.find_one_and_delete(
+            {'user_id': user_id, 'date': day}, projection={'date': 1, 'steps': 1}
+        )
+        if deleted is not None:
+            await add_tombstone(user_id, 'steps', day, stamp)
+    if deleted is None:
+        if not buffered:
+            raise HTTPException(status_code=404, detail="No steps logged for this date")
+        return {"message": "Steps deleted successfully"}
+    await db.step_hours.delete_many({'_id': {'$gte': user_key(user_id, day), '$lte': user_key(user_id, f'{day}T23')}})
+    await apply_step_week_deltas(user_id, {day: -deleted.get('steps', 0)})
+    await set_activity(user_id, 'steps', {day: False})
+    await invalidate_cached(user_id, 'steps')
+    return {"message": "Steps deleted successfully"}
+
+# Activity
+@api_router.get("/activity/streaks")
+async def get_activity_streaks(
+    request: Request,
+    kind: str = Query('workouts', pattern='^(workouts|steps|any)$'),
+    user_id: str = Depends(current_user)
+):
+    async def streaks():
+        today = date.today()
+        years = await load_activity(user_id, activity_kinds(kind))
+        return {'kind': kind, **compute_streaks(years, today)}, {}
+    return await cached_json(
+        request, user_tags(user_id, 'workouts', 'steps'), streaks, key_extra=(date.today(),), user_id=user_id
+    )
+
+@api_router.get("/activity/calendar")
+async def get_activity_calendar(
+    request: Request,
+    start_year: Optional[int] = Query(None, ge=1, le=9999),
+    end_year: Optional[int] = Query(None, ge=1, le=9999),
+    kind: str = Query('workouts', pattern='^(workouts|steps|any)$'),
+    format: str = Query('bitmap', pattern='^(bitmap|dates)$'),
+    user_id: str = Depends(current_user)
+):
+    # bitmap: per year, base64 of a little-endian bitset, bit n = day n of the year
+    end_year = end_year or date.today().year
+    start_year = start_year or end_year
+    if start_year > end_year:
+        raise HTTPException(status_code=400, detail="start_year must not be after end_year")
+    if end_year - start_year >= MAX_ACTIVITY_YEARS:
+        raise HTTPException(status_code=400, detail=f"Year range is limited to {MAX_ACTIVITY_YEARS} years")
+
+    async def calendar():
+        years = await load_activity(user_id, activity_kinds(kind), start_year, end_year)
+        out = []
+        for year in range(start_year, end_year + 1):
+            bitmap = years.get(year, 0)
+            days = date(year, 12, 31).timetuple().tm_yday
+            entry = {'year': year, 'days': days, 'active_days': bitmap.bit_count()}
+            if format == 'dates':
+                first = date(year, 1, 1)
+                entry['dates'] = [
+                    (first + timedelta(days=n)).isoformat() for n in range(days) if bitmap >> n & 1
+                ]
+            else:
+                entry['bitmap'] = base64.b64encode(bitmap.to_bytes((days + 7) // 8, 'little')).decode()
+            out.append(entry)
+        return {'kind': kind, 'years': out}, {}
+    return await cached_json(request, user_tags(user_id, 'workouts', 'steps'), calendar, user_id=user_id)
+
+# Export / import
+# Full workout history as one row per set, read off the Motor cursor and written
+# out a chunk at a time, so memory stays flat however long the history. Imports
+# take the same rows in any of the three formats: consecutive rows with the same
+# workout_id (or date, without one) form a workout, validated like POST
+# /workouts and inserted in batches. Imported workouts get new ids. The formats
+# are in export_import.py.
+IMPORT_BATCH_WORKOUTS = 500
+MAX_IMPORT_ERRORS = 100
+
+async def export_row_chunks(query):
+    chunk = []
+    mongo_cursor = db.workouts.find(query).sort([('date', 1), ('_id', 1)]).batch_size(500)
+    async for doc in mongo_cursor:
+        chunk.extend(workout_rows(decode_workout(doc)))
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def import_workouts(user_id, rows):
+    imported, failed, errors, new_records = 0, 0, [], []
+    batch = []
+    created_at = datetime.utcnow().isoformat()
+
+    def fail(row_number, error):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append({'row': row_number, 'error': error})
+
+    def finish(first_row, group):
+        try:
+            workout = WorkoutCreate.model_validate(workout_from_rows(group)).model_dump()
+            workout['created_at'] = imported_created_at(group[0].get('created_at'), created_at)
+        except ValidationError as e:
+            fail(first_row, '; '.join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            return
+        except (TypeError, ValueError):
+            fail(first_row, "created_at: Invalid isoformat string")
+            return
+        workout['_id'] = ObjectId()
+        batch.append((first_row, workout))
+
+    async def flush():
+        nonlocal imported
+        docs = [w for _, w in batch]
+        write_errors = await insert_workouts(user_id, docs)
+        for pos, error in write_errors.items():
+            fail(batch[pos][0], error)
+        imported += len(docs) - len(write_errors)
+        new_records.extend(await record_workout_changes(
+            user_id, added=[d for pos, d in enumerate(docs) if pos not in write_errors]
+        ))
+        batch.clear()
+
+    group, group_key, first_row = [], None, None
+    async for row_number, row, error in rows:
+        if error:
+            fail(row_number, error)
+            continue
+        key = row.get('workout_id') or row.get('date')
+        if group and key != group_key:
+            finish(first_row, group)
+            group = []
+            if len(batch) >= IMPORT_BATCH_WORKOUTS:
+                await flush()
+        if not group:
+            group_key, first_row = key, row_number
+        group.append(row)
+    if group:
+        finish(first_row, group)
+    if batch:
+        await flush()
+    errors.sort(key=lambda e: e['row'])
+    return {'imported': imported, 'failed': failed, 'errors': errors, 'new_records': new_records}
+
+@api_router.get("/export/workouts")
+async def export_workouts(
+    format: str = Query('csv', pattern='^(csv|ndjson|parquet)$'),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    user_id: str = Depends(current_user)
+):
+    require_parquet(format)
+    query = {'user_id': user_id, **date_range_query(start_date, end_date)}
+    encode = {'csv': encode_csv, 'ndjson': encode_ndjson, 'parquet': encode_parquet}[format]
+    return StreamingResponse(
+        encode(export_row_chunks(query)),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="workouts.{format}"'}
+    )
+
+@api_router.post("/import/workouts")
+async def import_workouts_file(
+    request: Request,
+    format: str = Query('csv', pattern='^(csv|ndjson|parquet)$'),
+    user_id: str = Depends(current_user)
+):
+    # Workouts are committed batch by batch; a failed row only drops its workout
+    require_parquet(format)
+    return await import_workouts(user_id, IMPORT_DECODERS[format](request))
+
+# Delta sync
+@api_router.get("/sync")
+async def sync_changes(
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    user_id: str = Depends(current_user)
+):
+    # Apply `deleted` before upserting the changed documents; repeat with
+    # `next` while has_more is set
+    last_seq = 0
+    if since:
+        last_seq, issued_at = decode_sync_token(since)
+        if time.time() - issued_at > SYNC_TOMBSTONE_DAYS * 86400:
+            raise HTTPException(status_code=410, detail="Sync token expired; sync again without one")
+    return await compute_sync(user_id, last_seq, limit)
 
 # Include router
 app.include_router(api_router)
@@ -219,7 +2473,22 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
 )
+app.add_middleware(ProfilingMiddleware)
+# Outermost, so CORS preflights and error responses are counted too
+app.add_middleware(RequestMetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(metrics_registry), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/debug/slow-queries", include_in_schema=False)
+async def recent_slow_queries(x_debug_token: Optional[str] = Header(None)):
+    # Newest first; hidden unless DEBUG_TOKEN is configured and sent
+    if not debug_token_valid(x_debug_token):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(slow_command_json(list(reversed(slow_queries))), media_type='application/json')
 
 # Configure logging
 logging.basicConfig(
@@ -228,6 +2497,98 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+# One-off migrations
+# Data migrations run once per database, not on every worker start. The first
+# worker to claim a migration's document in `migrations` runs it and marks it
+# done; the others wait for that before reporting ready. A claim is renewed
+# while the migration runs and expires after MIGRATION_LEASE_SECONDS without
+# renewal, so a worker killed halfway doesn't block startup for good; every
+# migration is safe to run again from the start.
+MIGRATION_LEASE_SECONDS = float(os.environ.get('MIGRATION_LEASE_SECONDS', 60))
+
+async def claim_migration(name):
+    now = datetime.utcnow()
+    try:
+        await db.migrations.update_one(
+            {'_id': name, 'state': 'running', 'expires_at': {'$lt': now}},
+            {'$set': {'expires_at': now + timedelta(seconds=MIGRATION_LEASE_SECONDS), 'started_at': now}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # Done, or running with a live claim
+        return False
+
+async def renew_migration_claim(name):
+    while True:
+        await asyncio.sleep(MIGRATION_LEASE_SECONDS / 3)
+        await db.migrations.update_one(
+            {'_id': name, 'state': 'running'},
+            {'$set': {'expires_at': datetime.utcnow() + timedelta(seconds=MIGRATION_LEASE_SECONDS)}}
+        )
+
+async def run_once(name, migration):
+    while not await claim_migration(name):
+        marker = await db.migrations.find_one({'_id': name})
+        if marker is not None and marker['state'] == 'done':
+            return
+        await asyncio.sleep(1)
+    renewal = asyncio.create_task(renew_migration_claim(name))
+    try:
+        started = time.perf_counter()
+        await migration()
+    except BaseException:
+        await db.migrations.delete_one({'_id': name, 'state': 'running'})
+        raise
+    finally:
+        renewal.cancel()
+    await db.migrations.update_one(
+        {'_id': name}, {'$set': {'state': 'done', 'finished_at': datetime.utcnow()}, '$unset': {'expires_at': ''}}
+    )
+    logger.info(f"Migration {name} done in {time.perf_counter() - started:.1f}s")
+
+async def migrate_legacy_user_data():
+    # Data written before per-user partitioning belongs to DEFAULT_USER_ID. Its
+    # derived documents were keyed without a user, so they are dropped and
+    # rebuilt under the default user's keys; step_hours can't be rebuilt and is
+    # re-keyed instead.
+    missing = {'user_id': {'$exists': False}}
+    unprefixed = {'_id': {'$regex': '^[^:]*$'}}
+    migrated = 0
+    for collection in ('workouts', 'steps', 'sync_tombstones'):
+        result = await db[collection].update_many(missing, {'$set': {'user_id': DEFAULT_USER_ID}})
+        migrated += result.modified_count
+    if not migrated:
+        return
+    counter = await db.counters.find_one_and_delete({'_id': SYNC_COUNTER_ID})
+    if counter:
+        await db.counters.update_one(
+            {'_id': user_key(DEFAULT_USER_ID, SYNC_COUNTER_ID)}, {'$max': {'seq': counter['seq']}}, upsert=True
+        )
+    hours = await db.step_hours.find(unprefixed).to_list(None)
+    await upsert_increments('step_hours', [
+        ({'_id': user_key(DEFAULT_USER_ID, h['_id'])}, {'$inc': {'steps': h['steps'], 'samples': h['samples']}})
+        for h in hours
+    ])
+    await db.step_hours.delete_many({'_id': {'$in': [h['_id'] for h in hours]}})
+    await db.workout_rollups.delete_many(missing)
+    await db.personal_records.delete_many(missing)
+    await db.step_weeks.delete_many(unprefixed)
+    await rebuild_workout_rollups(DEFAULT_USER_ID)
+    await rebuild_personal_records(DEFAULT_USER_ID)
+    await rebuild_step_weeks(DEFAULT_USER_ID)
+    await rebuild_activity(DEFAULT_USER_ID)
+    logger.info(f"Assigned {migrated} legacy documents to user {DEFAULT_USER_ID}")
+
+async def prepare_database():
+    mongo_command_metrics.loop = asyncio.get_running_loop()
+    await warm_up_pool()
+    await ensure_indexes()
+    await run_once('legacy_user_data', migrate_legacy_user_data)
+    await run_once('sync_seqs', backfill_sync_seqs)
+    await run_once('workout_rollups', seed_workout_rollups)
+    await run_once('activity_days', seed_activity)
+    if os.environ.get('VERIFY_QUERY_PLANS') == '1':
+        failures = await check_query_plans()
+        if failures:
+            raise RuntimeError(f"Queries not backed by an index: {failures}")
\ No newline at end of file
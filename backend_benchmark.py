@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""Latency and throughput benchmark for the fitness tracking backend.
+
+Seeds a dedicated MongoDB database with synthetic users, workouts and step logs,
+then drives each endpoint with a concurrent async load profile and reports
+p50/p95/p99 latency and requests per second. Runs can be saved as baselines under
+test_reports/benchmarks/ and later runs compared against them.
+
+Needs a local MongoDB (e.g. `docker run -p 27017:27017 mongo:7`); MONGO_URL
+defaults to mongodb://localhost:27017.
+
+    python backend_benchmark.py --workouts 100000 --save-baseline main
+    python backend_benchmark.py --workouts 100000 --skip-seed --compare main
+    python backend_benchmark.py --mode uvicorn --uvicorn-workers 4 --profiles list_workouts,dashboard
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+BACKEND_DIR = ROOT_DIR / 'backend'
+BASELINE_DIR = ROOT_DIR / 'test_reports' / 'benchmarks'
+
+# server.py reads its configuration at import time
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ['DB_NAME'] = os.environ.get('BENCHMARK_DB_NAME', 'fitness_benchmark')
+sys.path.insert(0, str(BACKEND_DIR))
+
+import httpx  # noqa: E402
+import server  # noqa: E402
+
+SEED_BATCH = 5000
+MAX_SPAN_DAYS = 3650
+
+# Synthetic data
+def user_ids(count):
+    return [f'bench-{i}' for i in range(count)]
+
+def generate_workout(rng, user_id, day, catalog):
+    exercises = []
+    for exercise in rng.sample(catalog, rng.randint(1, min(6, len(catalog)))):
+        base = rng.choice([20, 40, 60, 80, 100])
+        exercises.append({
+            'name': exercise['name'],
+            'category': exercise['category'],
+            'sets': [
+                {'reps': rng.randint(3, 15), 'weight': base + 2.5 * rng.randint(0, 8), 'completed': rng.random() > 0.05}
+                for _ in range(rng.randint(1, 5))
+            ]
+        })
+    return {
+        'user_id': user_id,
+        'date': day.isoformat(),
+        'exercises': exercises,
+        'duration': rng.randint(15, 120),
+        'notes': rng.choice([None, None, 'Felt strong', 'Deload week']),
+        'created_at': datetime.combine(day, datetime.min.time()) + timedelta(hours=rng.randint(6, 21))
+    }
+
+async def seed(db, workouts, users, seed_value):
+    # Spreads `workouts` over `users` and one daily step log per user and day,
+    # written straight to MongoDB in the server's storage format, then builds
+    # every derived collection the way the server does
+    rng = random.Random(seed_value)
+    catalog = [{'name': e['name'], 'category': e['category']} for e in server.exercise_catalog.exercises]
+    ids = user_ids(users)
+    per_user = math.ceil(workouts / users)
+    span = max(30, min(per_user, MAX_SPAN_DAYS))
+    today = date.today()
+    seqs = dict.fromkeys(ids, 0)
+    now = datetime.utcnow()
+
+    def stamp(user_id):
+        seqs[user_id] += 1
+        return {'seq': seqs[user_id], 'updated_at': now}
+
+    started = time.perf_counter()
+    batch = []
+    for n in range(workouts):
+        user_id = ids[n % users]
+        day = today - timedelta(days=rng.randrange(span))
+        batch.append({**server.encode_workout(generate_workout(rng, user_id, day, catalog)), **stamp(user_id)})
+        if len(batch) >= SEED_BATCH:
+            await db.workouts.insert_many(batch, ordered=False)
+            batch = []
+            print(f'  workouts: {n + 1}/{workouts}', end='\r', flush=True)
+    if batch:
+        await db.workouts.insert_many(batch, ordered=False)
+
+    steps = [
+        {'user_id': user_id, 'date': (today - timedelta(days=d)).isoformat(),
+         'steps': rng.randint(0, 20000), **stamp(user_id)}
+        for user_id in ids for d in range(min(span, 365))
+    ]
+    for i in range(0, len(steps), SEED_BATCH):
+        await db.steps.insert_many(steps[i:i + SEED_BATCH], ordered=False)
+    await db.counters.insert_many(
+        [{'_id': server.user_key(u, server.SYNC_COUNTER_ID), 'seq': seq} for u, seq in seqs.items()]
+    )
+    print(f'  inserted {workouts} workouts and {len(steps)} step logs in {time.perf_counter() - started:.1f}s')
+
+    started = time.perf_counter()
+    await server.ensure_indexes()
+    for user_id in ids:
+        await server.rebuild_workout_rollups(user_id)
+        await server.rebuild_personal_records(user_id)
+        await server.rebuild_step_weeks(user_id)
+        await server.rebuild_activity(user_id)
+    print(f'  built indexes and derived collections in {time.perf_counter() - started:.1f}s')
+
+async def sample_workout_ids(db, users, size=1000):
+    docs = await db.workouts.aggregate([
+        {'$match': {'user_id': {'$in': user_ids(users)}}},
+        {'$sample': {'size': size}},
+        {'$project': {'user_id': 1}}
+    ]).to_list(None)
+    return [(d['user_id'], str(d['_id'])) for d in docs]
+
+# Load profiles
+# Each returns (method, path, headers, json body) for one request
+def profile_builders(users, workout_ids, catalog):
+    today = date.today()
+    ids = user_ids(users)
+
+    def user(rng):
+        return {'X-User-Id': rng.choice(ids)}
+
+    def date_range(rng, days):
+        end = today - timedelta(days=rng.randrange(365))
+        return f'start_date={(end - timedelta(days=days)).isoformat()}&end_date={end.isoformat()}'
+
+    def get(path_fn):
+        return lambda rng: ('GET', path_fn(rng), user(rng), None)
+
+    def get_workout(rng):
+        user_id, workout_id = rng.choice(workout_ids)
+        return 'GET', f'/api/workouts/{workout_id}', {'X-User-Id': user_id}, None
+
+    def create_workout(rng):
+        body = generate_workout(rng, None, today - timedelta(days=rng.randrange(30)), catalog)
+        body.pop('user_id')
+        body.pop('created_at')
+        return 'POST', '/api/workouts', user(rng), body
+
+    def log_steps(rng):
+        body = {'date': (today - timedelta(days=rng.randrange(7))).isoformat(), 'steps': rng.randint(0, 20000)}
+        return 'POST', '/api/steps', user(rng), body
+
+    return {
+        'health': get(lambda rng: '/api/'),
+        'list_workouts': get(lambda rng: '/api/workouts?limit=50'),
+        'list_workouts_range': get(lambda rng: f'/api/workouts?limit=100&{date_range(rng, 30)}'),
+        'list_workouts_summary': get(lambda rng: '/api/workouts?limit=50&view=summary'),
+        'get_workout': get_workout,
+        'workout_series': get(lambda rng: f'/api/workouts/series?granularity=week&{date_range(rng, 180)}'),
+        'stats': get(lambda rng: '/api/workouts/stats/summary'),
+        'dashboard': get(lambda rng: '/api/dashboard'),
+        'progression': get(lambda rng: f"/api/exercises/{rng.choice(catalog)['name']}/progression"),
+        'records': get(lambda rng: '/api/records'),
+        'exercise_search': get(lambda rng: f"/api/exercises/search?q={rng.choice(['be', 'squ', 'curl', 'press', 'rwo'])}"),
+        'list_steps': get(lambda rng: '/api/steps?limit=100'),
+        'step_weeks': get(lambda rng: f'/api/steps?granularity=week&{date_range(rng, 83)}'),
+        'activity_streaks': get(lambda rng: '/api/activity/streaks'),
+        'sync': get(lambda rng: '/api/sync?limit=500'),
+        'create_workout': create_workout,
+        'log_steps': log_steps,
+    }
+
+def percentile(sorted_values, p):
+    # Nearest-rank
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))]
+
+async def run_profile(client, build, concurrency, duration, warmup, seed_value):
+    latencies, errors = [], 0
+
+    async def worker(index, deadline, record):
+        nonlocal errors
+        rng = random.Random(seed_value * 1000 + index)
+        while time.perf_counter() < deadline:
+            method, path, headers, body = build(rng)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, headers=headers, json=body)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            elapsed = time.perf_counter() - started
+            if record:
+                latencies.append(elapsed)
+                errors += failed
+
+    if warmup:
+        deadline = time.perf_counter() + warmup
+        await asyncio.gather(*(worker(i, deadline, False) for i in range(concurrency)))
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(worker(i, deadline, True) for i in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / wall, 1),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+    }
+
+# Targets
+class InProcessTarget:
+    # The ASGI app called directly; no network or server process in between
+    async def __aenter__(self):
+        self.lifespan = server.app.router.lifespan_context(server.app)
+        await self.lifespan.__aenter__()
+        # Unhandled errors become 500s, counted like any other failed request
+        transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+        self.client = httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=60)
+        return self.client
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        await self.lifespan.__aexit__(*exc)
+
+class UvicornTarget:
+    # uvicorn in a subprocess against the same database
+    def __init__(self, port, workers):
+        self.port = port
+        self.workers = workers
+
+    async def __aenter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'server:app', '--port', str(self.port),
+             '--workers', str(self.workers), '--log-level', 'warning'],
+            cwd=BACKEND_DIR, env=os.environ.copy()
+        )
+        base_url = f'http://127.0.0.1:{self.port}'
+        self.client = httpx.AsyncClient(
+            base_url=base_url, timeout=60, limits=httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        )
+        deadline = time.monotonic() + 60
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError('uvicorn exited during startup')
+            try:
+                if (await self.client.get('/api/health/ready')).status_code == 200:
+                    return self.client
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'uvicorn did not come up on {base_url}')
+            await asyncio.sleep(0.2)
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+class UrlTarget:
+    # An already running server, e.g. one started by hand with other settings
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(
+            base_url=self.url, timeout=60, limits=httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        )
+        return self.client
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+
+# Baselines
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def baseline_path(name):
+    return BASELINE_DIR / f'{name}.json'
+
+def compare(run, baseline, threshold):
+    # Returns the profiles whose p95 latency or throughput regressed by more than threshold percent
+    regressions = []
+    print(f"\nCompared with baseline from {baseline['created_at']} (commit {baseline.get('commit')})")
+    if baseline['config'] != run['config']:
+        print(f"  note: configuration differs: {baseline['config']}")
+    print(f"{'profile':<24}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}{'rps':>18}")
+    for name, result in run['results'].items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps'):
+            old, new = before[key], result[key]
+            change = (new - old) / old * 100 if old else 0.0
+            cells.append(f'{new} ({change:+.0f}%)')
+        p95_change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+        rps_change = (result['rps'] - before['rps']) / before['rps'] * 100 if before['rps'] else 0
+        flag = ''
+        if p95_change > threshold or rps_change < -threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<24}' + ''.join(f'{c:>18}' for c in cells) + flag)
+    return regressions
+
+def print_results(results):
+    print(f"\n{'profile':<24}{'requests':>10}{'errors':>8}{'rps':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<24}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10}"
+              f"{r['mean_ms']!s:>10}{r['p50_ms']!s:>10}{r['p95_ms']!s:>10}{r['p99_ms']!s:>10}")
+
+async def main(args):
+    db_name = os.environ['DB_NAME']
+    if args.workouts < 1 or args.users < 1:
+        sys.exit('--workouts and --users must be positive')
+    if not args.skip_seed and 'bench' not in db_name and not args.force:
+        sys.exit(f'Refusing to drop database {db_name!r}; use a name containing "bench" or pass --force')
+    # Its own client for seeding; the in-process target's lifespan opens another
+    server.connect_mongo()
+    try:
+        if not args.skip_seed:
+            print(f'Seeding {db_name}: {args.workouts} workouts for {args.users} users')
+            await server.client.drop_database(db_name)
+            await seed(server.db, args.workouts, args.users, args.seed)
+        workout_ids = await sample_workout_ids(server.db, args.users)
+    finally:
+        server.client.close()
+
+    catalog = [{'name': e['name'], 'category': e['category']} for e in server.exercise_catalog.exercises]
+    builders = profile_builders(args.users, workout_ids, catalog)
+    if not workout_ids:
+        del builders['get_workout']
+    selected = args.profiles.split(',') if args.profiles else [n for n in builders if n not in ('create_workout', 'log_steps')]
+    if args.writes:
+        selected += [n for n in ('create_workout', 'log_steps') if n not in selected]
+    unknown = [n for n in selected if n not in builders]
+    if unknown:
+        sys.exit(f"Unknown profiles: {', '.join(unknown)}; available: {', '.join(builders)}")
+
+    if args.mode == 'inprocess':
+        target = InProcessTarget()
+    elif args.mode == 'uvicorn':
+        target = UvicornTarget(args.port, args.uvicorn_workers)
+    else:
+        target = UrlTarget(args.url)
+
+    results = {}
+    async with target as client:
+        for name in selected:
+            print(f'Running {name} ({args.concurrency} concurrent, {args.duration}s)...', flush=True)
+            results[name] = await run_profile(
+                client, builders[name], args.concurrency, args.duration, args.warmup, args.seed
+            )
+    print_results(results)
+
+    run = {
+        'created_at': datetime.utcnow().isoformat(),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'config': {
+            'mode': args.mode, 'workouts': args.workouts, 'users': args.users,
+            'concurrency': args.concurrency, 'duration': args.duration,
+            'uvicorn_workers': args.uvicorn_workers if args.mode == 'uvicorn' else None
+        },
+        'results': results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(run, indent=2) + '\n')
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+        baseline_path(args.save_baseline).write_text(json.dumps(run, indent=2) + '\n')
+        print(f'\nSaved baseline {baseline_path(args.save_baseline)}')
+    if args.compare:
+        baseline = json.loads(baseline_path(args.compare).read_text())
+        regressions = compare(run, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressed beyond {args.threshold}%: {', '.join(regressions)}")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--mode', choices=('inprocess', 'uvicorn', 'url'), default='inprocess')
+    parser.add_argument('--url', default=os.environ.get('BENCHMARK_URL', 'http://127.0.0.1:8001'),
+                        help='server root for --mode url (without /api)')
+    parser.add_argument('--port', type=int, default=8765, help='port for --mode uvicorn')
+    parser.add_argument('--uvicorn-workers', type=int, default=1)
+    parser.add_argument('--workouts', type=int, default=10000, help='synthetic workouts to seed (1k to 1M)')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1, help='random seed for data and request mix')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the data from a previous run')
+    parser.add_argument('--force', action='store_true', help='allow dropping a database without "bench" in its name')
+    parser.add_argument('--profiles', help='comma-separated profiles; default all read profiles')
+    parser.add_argument('--writes', action='store_true', help='also run the write profiles')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per profile')
+    parser.add_argument('--warmup', type=float, default=2, help='unrecorded seconds before each profile')
+    parser.add_argument('--output', help='write this run as JSON to a file')
+    parser.add_argument('--save-baseline', metavar='NAME', help=f'save this run as {BASELINE_DIR}/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=10, help='regression threshold in percent')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 import requests
 import json
 from datetime import datetime, date, timedelta
@@ -7,7 +8,8 @@ import sys
 from typing import Dict, Any
 
 # Configuration
-BASE_URL = "https://workout-logger-102.preview.emergentagent.com/api"
+# BASE_URL points the tests at another deployment, e.g. http://127.0.0.1:8001/api
+BASE_URL = os.environ.get("BASE_URL", "https://workout-logger-102.preview.emergentagent.com/api")
 session = requests.Session()
 session.headers.update({"Content-Type": "application/json"})
 
@@ -3,44 +3,30 @@ import { View, Text, StyleSheet, ScrollView, Dimensions } from 'react-native';
 import { Ionicons } from '@expo/vector-icons';
 import { LineChart, BarChart } from 'react-native-gifted-charts';
 import { useWorkoutStore } from '../../store/workoutStore';
-import { format, subDays, startOfWeek, endOfWeek } from 'date-fns';
+import { format, parseISO, startOfWeek, endOfWeek } from 'date-fns';
 
 const screenWidth = Dimensions.get('window').width;
 
 export default function ProgressScreen() {
-  const { workouts, stats, fetchWorkouts, fetchStats } = useWorkoutStore();
+  const { series, stats, fetchDashboard } = useWorkoutStore();
   const [chartData, setChartData] = useState<any[]>([]);
 
   useEffect(() => {
-    fetchWorkouts();
-    fetchStats();
+    fetchDashboard();
   }, []);
 
   useEffect(() => {
-    if (workouts.length > 0) {
-      // Prepare data for last 7 days
-      const last7Days = [];
-      const today = new Date();
-
-      for (let i = 6; i >= 0; i--) {
-        const date = subDays(today, i);
-        const dateStr = format(date, 'yyyy-MM-dd');
-        const workoutsOnDay = workouts.filter((w) => w.date === dateStr);
-        const totalExercises = workoutsOnDay.reduce(
-          (sum, w) => sum + w.exercises.length,
-          0
-        );
-
-        last7Days.push({
-          value: totalExercises,
-          label: format(date, 'EEE'),
-          date: dateStr,
-        });
-      }
-
-      setChartData(last7Days);
+    if (series.length > 0) {
+      // Last 7 days, bucketed server-side
+      setChartData(
+        series.map((bucket) => ({
+          value: bucket.exercises,
+          label: format(parseISO(bucket.period), 'EEE'),
+          date: bucket.period,
+        }))
+      );
     }
-  }, [workouts]);
+  }, [series]);
 
   const StatCard = ({
     icon,
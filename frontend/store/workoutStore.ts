@@ -1,7 +1,14 @@
 import { create } from 'zustand';
 import axios from 'axios';
+import { format } from 'date-fns';
 
 const API_URL = process.env.EXPO_PUBLIC_BACKEND_URL;
+const USER_ID = process.env.EXPO_PUBLIC_USER_ID;
+
+// The backend partitions all data by X-User-Id; without it requests act as the default user
+if (USER_ID) {
+  axios.defaults.headers.common['X-User-Id'] = USER_ID;
+}
 
 interface ExerciseSet {
   reps: number;
@@ -22,14 +29,34 @@ interface Workout {
   duration?: number;
   notes?: string;
   created_at?: string;
+  updated_at?: string;
+}
+
+interface SeriesBucket {
+  period: string;
+  workouts: number;
+  exercises: number;
+  sets: number;
+  volume: number;
+  duration: number;
 }
 
+// Applies one page of GET /api/sync: deletions first, then changed workouts
+const applyWorkoutChanges = (workouts: Workout[], changed: Workout[], deleted: string[]) => {
+  const removed = new Set([...deleted, ...changed.map((w) => w._id)]);
+  return [...workouts.filter((w) => !removed.has(w._id)), ...changed].sort(
+    (a, b) => b.date.localeCompare(a.date) || (b._id ?? '').localeCompare(a._id ?? '')
+  );
+};
+
 interface WorkoutStore {
   workouts: Workout[];
+  syncToken: string | null;
   currentWorkout: Exercise[];
   loading: boolean;
   error: string | null;
   stats: any;
+  series: SeriesBucket[];
   steps: number;
   
   // Workout actions
@@ -43,16 +70,19 @@ interface WorkoutStore {
   saveWorkout: (date: string, duration?: number, notes?: string) => Promise<void>;
   deleteWorkout: (id: string) => Promise<void>;
   fetchStats: () => Promise<void>;
+  fetchDashboard: () => Promise<void>;
   updateSteps: (steps: number) => void;
   saveSteps: (date: string, steps: number) => Promise<void>;
 }
 
 export const useWorkoutStore = create<WorkoutStore>((set, get) => ({
   workouts: [],
+  syncToken: null,
   currentWorkout: [],
   loading: false,
   error: null,
   stats: null,
+  series: [],
   steps: 0,
 
   addExerciseToWorkout: (exercise) => {
@@ -79,12 +109,28 @@ export const useWorkoutStore = create<WorkoutStore>((set, get) => ({
     set({ currentWorkout: [] });
   },
 
+  // Pulls only what changed since the last sync; the first call pulls everything
   fetchWorkouts: async () => {
     set({ loading: true, error: null });
     try {
-      const response = await axios.get(`${API_URL}/api/workouts`);
-      set({ workouts: response.data, loading: false });
+      let token = get().syncToken;
+      let workouts = token ? get().workouts : [];
+      let hasMore = true;
+      while (hasMore) {
+        const response = await axios.get(`${API_URL}/api/sync`, {
+          params: token ? { since: token } : {},
+        });
+        workouts = applyWorkoutChanges(workouts, response.data.workouts, response.data.deleted.workouts);
+        token = response.data.next;
+        hasMore = response.data.has_more;
+      }
+      set({ workouts, syncToken: token, loading: false });
     } catch (error: any) {
+      if (error.response?.status === 410 && get().syncToken) {
+        // Token outlived the server's tombstones: start over with a full sync
+        set({ syncToken: null });
+        return get().fetchWorkouts();
+      }
       set({ error: error.message, loading: false });
     }
   },
@@ -129,6 +175,16 @@ export const useWorkoutStore = create<WorkoutStore>((set, get) => ({
     }
   },
 
+  // Stats and the 7-day series in a single round-trip
+  fetchDashboard: async () => {
+    try {
+      const response = await axios.get(`${API_URL}/api/dashboard`);
+      set({ stats: response.data.stats, series: response.data.series });
+    } catch (error: any) {
+      console.error('Error fetching dashboard:', error);
+    }
+  },
+
   updateSteps: (steps) => {
     set({ steps });
   },
@@ -136,7 +192,12 @@ export const useWorkoutStore = create<WorkoutStore>((set, get) => ({
   saveSteps: async (date, steps) => {
     try {
       await axios.post(`${API_URL}/api/steps`, { date, steps });
-      await get().fetchStats();
+      // Step writes are buffered on the server, so an immediate refetch would
+      // still see the old total; apply the posted value locally instead
+      const stats = get().stats;
+      if (stats && date === format(new Date(), 'yyyy-MM-dd')) {
+        set({ stats: { ...stats, total_steps_today: steps } });
+      }
     } catch (error: any) {
       console.error('Error saving steps:', error);
     }
@@ -0,0 +1,84 @@
+from datetime import date, timedelta
+
+import server
+
+
+def bitmaps(*days):
+    # {year: bitmap} the way load_activity returns it
+    years = {}
+    for day in days:
+        years[day.year] = years.get(day.year, 0) | 1 << day.timetuple().tm_yday - 1
+    return years
+
+
+def span(first, count):
+    return [first + timedelta(days=n) for n in range(count)]
+
+
+def test_no_activity():
+    assert server.compute_streaks({}, date(2025, 1, 5)) == {
+        'current_streak': 0, 'longest_streak': 0, 'active_days_this_year': 0,
+        'total_active_days': 0, 'last_active': None
+    }
+
+
+def test_streak_including_today():
+    streaks = server.compute_streaks(bitmaps(*span(date(2025, 1, 1), 5)), date(2025, 1, 5))
+    assert streaks['current_streak'] == 5
+    assert streaks['longest_streak'] == 5
+    assert streaks['last_active'] == '2025-01-05'
+
+
+def test_today_not_logged_yet_keeps_the_streak():
+    streaks = server.compute_streaks(bitmaps(*span(date(2025, 1, 1), 4)), date(2025, 1, 5))
+    assert streaks['current_streak'] == 4
+    assert streaks['last_active'] == '2025-01-04'
+
+
+def test_gap_ends_the_streak():
+    years = bitmaps(*span(date(2025, 1, 1), 3), date(2025, 1, 5))
+    streaks = server.compute_streaks(years, date(2025, 1, 6))
+    assert streaks['current_streak'] == 1
+    assert streaks['longest_streak'] == 3
+    assert streaks['total_active_days'] == 4
+    assert server.compute_streaks(years, date(2025, 1, 7))['current_streak'] == 0
+
+
+def test_streak_across_years():
+    # 2024 is a leap year, so Dec 31 is bit 365 of its bitmap
+    years = bitmaps(*span(date(2024, 12, 29), 5))
+    assert years[2024] == 0b111 << 363
+    streaks = server.compute_streaks(years, date(2025, 1, 2))
+    assert streaks['current_streak'] == 5
+    assert streaks['longest_streak'] == 5
+    assert streaks['active_days_this_year'] == 2
+    assert streaks['total_active_days'] == 5
+
+
+def test_future_days_are_not_last_active():
+    years = bitmaps(date(2025, 1, 1), date(2025, 1, 2), date(2025, 3, 1))
+    streaks = server.compute_streaks(years, date(2025, 1, 2))
+    assert streaks['current_streak'] == 2
+    assert streaks['last_active'] == '2025-01-02'
+    assert streaks['total_active_days'] == 3
+
+
+def test_today_before_first_active_year():
+    streaks = server.compute_streaks(bitmaps(date(2025, 6, 1)), date(2024, 12, 31))
+    assert streaks['current_streak'] == 0
+    assert streaks['last_active'] is None
+
+
+def test_longest_run():
+    assert server.longest_run(0) == 0
+    assert server.longest_run(0b1011101110) == 3
+    assert server.longest_run((1 << 200) - 1) == 200
+
+
+def test_activity_words_round_trip_through_int64():
+    # Day 64 of a word sets the sign bit, stored as a negative Int64
+    word, mask = server.activity_bit(date(2025, 3, 5))
+    assert (word, mask) == ('0', 1 << 63)
+    stored = server.to_int64(mask)
+    assert stored < 0
+    assert stored & (1 << 64) - 1 == mask
@@ -0,0 +1,67 @@
+import pytest
+
+import catalog
+
+EXERCISES = [
+    {'name': 'Bench Press', 'category': 'Chest', 'equipment': 'Barbell', 'muscles': ['Chest'], 'aliases': ['BP', 'Flat Bench']},
+    {'name': 'Incline Bench Press', 'category': 'Chest', 'equipment': 'Barbell', 'muscles': ['Chest']},
+    {'name': 'Dumbbell Bench Press', 'category': 'Chest', 'equipment': 'Dumbbell', 'muscles': ['Chest'], 'aliases': ['DB Bench']},
+    {'name': 'Bent Over Row', 'category': 'Back', 'equipment': 'Barbell', 'muscles': ['Lats']},
+    {'name': 'Squat', 'category': 'Legs', 'equipment': 'Barbell', 'muscles': ['Quads'], 'aliases': ['Back Squat']},
+    {'name': 'Front Squat', 'category': 'Legs', 'equipment': 'Barbell', 'muscles': ['Quads']},
+    {'name': 'Pull Up', 'category': 'Back', 'muscles': ['Lats'], 'aliases': ['Chin Up']},
+]
+
+
+@pytest.fixture(scope='module')
+def exercises():
+    return catalog.ExerciseCatalog([catalog.CatalogExercise(**e) for e in EXERCISES])
+
+
+def names(results):
+    return [e['name'] for e in results]
+
+
+def test_whole_name_prefix_ranks_first(exercises):
+    assert names(exercises.search('bench')) == ['Bench Press', 'Incline Bench Press', 'Dumbbell Bench Press']
+    assert names(exercises.search('be'))[:2] == ['Bench Press', 'Bent Over Row']
+
+
+def test_exact_name_beats_longer_prefix_matches(exercises):
+    assert names(exercises.search('squat')) == ['Squat', 'Front Squat']
+
+
+def test_aliases_match(exercises):
+    assert names(exercises.search('bp')) == ['Bench Press']
+    assert names(exercises.search('chin')) == ['Pull Up']
+    assert names(exercises.search('db bench')) == ['Dumbbell Bench Press']
+
+
+def test_every_query_word_has_to_match(exercises):
+    assert names(exercises.search('incline press')) == ['Incline Bench Press']
+
+
+def test_limit(exercises):
+    assert names(exercises.search('bench', limit=2)) == ['Bench Press', 'Incline Bench Press']
+
+
+def test_filters(exercises):
+    assert names(exercises.search(category='legs')) == ['Front Squat', 'Squat']
+    assert names(exercises.search('bench', equipment='dumbbell')) == ['Dumbbell Bench Press']
+    assert names(exercises.search(muscle='lats', category='back')) == ['Bent Over Row', 'Pull Up']
+    assert exercises.search('squat', category='chest') == []
+
+
+def test_typos_fall_back_to_trigrams(exercises):
+    assert names(exercises.search('bensh pres'))[0] == 'Bench Press'
+    assert names(exercises.search('sqaut'))[0] == 'Squat'
+    assert names(exercises.search('bensh pres', equipment='dumbbell')) == ['Dumbbell Bench Press']
+
+
+def test_unrelated_queries_find_nothing(exercises):
+    assert exercises.search('xyzzy') == []
+
+
+def test_duplicate_names_are_rejected():
+    with pytest.raises(ValueError):
+        catalog.ExerciseCatalog([catalog.CatalogExercise(**EXERCISES[0])] * 2)
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import export_import
+
+
+class Upload:
+    # Stands in for the Request: only stream() is read
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def decode(*chunks):
+    async def collect():
+        return [row async for row in export_import.decode_csv(Upload(chunks))]
+    return asyncio.run(collect())
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+CSV = (
+    '\ufeffdate,exercise,notes\r\n'
+    '2025-01-06,Bench Press,"heavy, felt ""good"""\r\n'
+    '2025-01-06,Squat,"two\nlines"\r\n'
+    '2025-01-08,Curl,\r\n'
+    '2025-01-09,Café Row,ok'
+).encode()
+
+ROWS = [
+    (1, {'date': '2025-01-06', 'exercise': 'Bench Press', 'notes': 'heavy, felt "good"'}, None),
+    (2, {'date': '2025-01-06', 'exercise': 'Squat', 'notes': 'two\nlines'}, None),
+    (3, {'date': '2025-01-08', 'exercise': 'Curl', 'notes': None}, None),
+    (4, {'date': '2025-01-09', 'exercise': 'Café Row', 'notes': 'ok'}, None),
+]
+
+
+@pytest.mark.parametrize('text, complete, rest', [
+    ('a,b\n1,2', 'a,b\n', '1,2'),
+    ('a,b\n1,2\n', 'a,b\n1,2\n', ''),
+    ('a,"b\nc"\n1,"2', 'a,"b\nc"\n', '1,"2'),
+    ('"x\n', '', '"x\n'),
+    ('', '', ''),
+])
+def test_split_csv_records(text, complete, rest):
+    assert export_import.split_csv_records(text) == (complete, rest)
+
+
+def test_decodes_in_one_chunk():
+    assert decode(CSV) == ROWS
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 16])
+def test_chunk_boundaries_do_not_matter(size):
+    # Splits land inside quoted fields, escaped quotes, CRLFs and the BOM and é
+    assert decode(*chunked(CSV, size)) == ROWS
+
+
+def test_unterminated_quote_is_reported():
+    rows = decode(b'date,notes\n2025-01-06,ok\n2025-01-07,"never closed\n')
+    assert rows == [
+        (1, {'date': '2025-01-06', 'notes': 'ok'}, None),
+        (2, None, "Unterminated quoted field"),
+    ]
+
+
+def test_blank_lines_are_skipped():
+    assert decode(b'\n date , steps \n\n2025-01-06,100\n\n') == [(1, {'date': '2025-01-06', 'steps': '100'}, None)]
+
+
+def test_empty_upload():
+    assert decode() == []
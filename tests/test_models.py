@@ -0,0 +1,31 @@
+import pytest
+from pydantic import ValidationError
+
+import server
+
+VALID_DAYS = ['2025-01-06', '2024-02-29']
+# fromisoformat accepts the first two on Python 3.11+, but they don't sort as dates
+INVALID_DAYS = ['20261016', '2026-W42-1', '2026-02-30', '2026-1-6', '']
+
+
+@pytest.mark.parametrize('day', VALID_DAYS)
+def test_workout_accepts_calendar_days(day):
+    assert server.WorkoutCreate(date=day, exercises=[]).date == day
+
+
+@pytest.mark.parametrize('day', INVALID_DAYS)
+def test_workout_rejects_other_date_forms(day):
+    with pytest.raises(ValidationError):
+        server.WorkoutCreate(date=day, exercises=[])
+
+
+@pytest.mark.parametrize('day', INVALID_DAYS)
+def test_step_log_rejects_other_date_forms(day):
+    with pytest.raises(ValidationError):
+        server.StepLog(date=day, steps=100)
+
+
+def test_parse_day_skips_legacy_dates():
+    assert server.parse_day('2025-01-06') == server.date(2025, 1, 6)
+    for day in [*INVALID_DAYS, None]:
+        assert server.parse_day(day) is None
@@ -0,0 +1,41 @@
+import asyncio
+import os
+import uuid
+
+import pymongo
+import pytest
+from pymongo.errors import PyMongoError
+
+import server
+
+# Needs a real MongoDB (explain isn't emulated); skipped when none is reachable
+TEST_MONGO_URL = os.environ.get('TEST_MONGO_URL', 'mongodb://localhost:27017')
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    try:
+        pymongo.MongoClient(TEST_MONGO_URL, serverSelectionTimeoutMS=1000).admin.command('ping')
+    except PyMongoError:
+        pytest.skip(f"no MongoDB at {TEST_MONGO_URL}")
+    db_name = f'fitness_test_{uuid.uuid4().hex[:8]}'
+    monkeypatch.setenv('MONGO_URL', TEST_MONGO_URL)
+    monkeypatch.setenv('DB_NAME', db_name)
+    monkeypatch.setattr(server, 'client', None)
+    monkeypatch.setattr(server, 'db', None)
+    yield db_name
+    sync_client = pymongo.MongoClient(TEST_MONGO_URL)
+    sync_client.drop_database(db_name)
+    sync_client.close()
+
+
+def test_every_endpoint_query_uses_an_index(mongo_db):
+    async def check():
+        server.connect_mongo()
+        try:
+            await server.ensure_indexes()
+            return await server.check_query_plans()
+        finally:
+            server.client.close()
+
+    assert asyncio.run(check()) == {}
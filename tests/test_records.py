@@ -0,0 +1,28 @@
+from bson import ObjectId
+
+import server
+
+
+def workout(*sets):
+    return {'_id': ObjectId(), 'date': '2025-01-06', 'exercises': [
+        {'name': 'Deadlifts', 'category': 'Back', 'sets': [
+            {'reps': reps, 'weight': weight, 'completed': completed} for reps, weight, completed in sets
+        ]}
+    ]}
+
+
+def test_failed_and_skipped_sets_are_not_records():
+    best = server.record_candidates([workout((5, 140.0, True), (0, 200.0, True), (3, 180.0, False))])['Deadlifts']
+    assert best['max_weight']['value'] == 140.0
+    assert best['best_e1rm']['value'] == round(server.estimate_1rm(140.0, 5), 2)
+    assert list(best['reps_at_weight']) == ['140']
+
+
+def test_only_failed_sets_give_no_candidates():
+    assert server.record_candidates([workout((0, 200.0, True))]) == {}
+
+
+def test_single_rep_counts_its_weight():
+    best = server.record_candidates([workout((1, 210.0, True), (5, 150.0, True))])['Deadlifts']
+    assert best['max_weight']['value'] == 210.0
+    assert best['best_e1rm']['value'] == 210.0
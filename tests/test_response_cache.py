@@ -0,0 +1,31 @@
+import server
+
+TAGS = server.user_tags('alice', 'workouts')
+
+
+def store(cache, key, body, version=None):
+    cache.set(key, {'body': body}, TAGS, cache.generation(TAGS), version)
+
+
+def test_entries_follow_the_change_version():
+    cache = server.ResponseCache()
+    store(cache, 'k', b'old', version=(3, (), 0))
+    assert cache.get('k', (3, (), 0))['body'] == b'old'
+    # Another worker allocated a seq: the entry is stale here too
+    assert cache.get('k', (4, (4,), 0)) is None
+    assert 'k' not in cache.entries
+    assert cache.metrics == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_invalidation_stops_an_older_computation_from_storing():
+    cache = server.ResponseCache()
+    generation = cache.generation(TAGS)
+    cache.invalidate(*TAGS)
+    cache.set('k', {'body': b'old'}, TAGS, generation)
+    assert cache.get('k') is None
+
+
+def test_expired_entries_are_dropped():
+    cache = server.ResponseCache(ttl=-1)
+    store(cache, 'k', b'old')
+    assert cache.get('k') is None
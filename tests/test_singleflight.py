@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_callers_share_one_execution():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def scenario():
+        flight = server.SingleFlight()
+        results = await asyncio.gather(*(flight.do('k', compute, name='summary') for _ in range(5)))
+        return flight, results
+
+    flight, results = run(scenario())
+    assert results == ['result'] * 5
+    assert calls == [1]
+    assert flight.metrics == {'summary': {'executions': 1, 'coalesced': 4, 'timeouts': 0}}
+    assert flight.calls == {}
+
+
+def test_later_callers_start_a_new_execution():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    async def scenario():
+        flight = server.SingleFlight()
+        return [await flight.do('k', compute), await flight.do('k', compute)]
+
+    assert run(scenario()) == [1, 2]
+
+
+def test_errors_reach_every_waiter():
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError('boom')
+
+    async def scenario():
+        flight = server.SingleFlight()
+        results = await asyncio.gather(*(flight.do('k', compute) for _ in range(3)), return_exceptions=True)
+        return flight, results
+
+    flight, results = run(scenario())
+    assert [type(r) for r in results] == [ValueError] * 3
+    assert flight.calls == {}
+
+
+def test_a_timed_out_waiter_leaves_the_computation_running():
+    done = []
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        done.append(1)
+        return 'late'
+
+    async def scenario():
+        flight = server.SingleFlight()
+        with pytest.raises(HTTPException) as raised:
+            await flight.do('k', compute, timeout=0.01)
+        assert raised.value.status_code == 504
+        # A caller arriving meanwhile joins the computation still in flight
+        assert await flight.do('k', compute) == 'late'
+        return flight
+
+    flight = run(scenario())
+    assert done == [1]
+    assert flight.metrics['default'] == {'executions': 1, 'coalesced': 1, 'timeouts': 1}
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from bson import ObjectId
+
+import server
+
+WORKOUT = {
+    '_id': ObjectId(),
+    'user_id': 'alice',
+    'date': '2025-01-06',
+    'exercises': [
+        {'name': 'Bench Press', 'category': 'Chest', 'sets': [
+            {'reps': 5, 'weight': 100.0, 'completed': True},
+            {'reps': 3, 'weight': 92.5, 'completed': False}
+        ]},
+        {'name': 'Planks', 'category': 'Core', 'sets': []}
+    ],
+    'duration': 45,
+    'notes': None,
+    'created_at': '2025-01-06T07:30:00'
+}
+
+def project(doc, projection):
+    # Top-level inclusion projection, as MongoDB applies it
+    return {k: v for k, v in doc.items() if k == '_id' or projection.get(k)}
+
+def test_round_trip_returns_api_shape():
+    doc = server.encode_workout(WORKOUT)
+    assert doc['v'] == server.WORKOUT_FORMAT
+    assert doc['exercises'][0] == {
+        'name': 'Bench Press', 'category': 'Chest', 'reps': [5, 3], 'weight': [100, 92.5], 'skipped': 2
+    }
+    assert 'notes' not in doc
+    assert isinstance(doc['created_at'], datetime)
+    decoded = server.decode_workout(doc)
+    assert decoded == {k: v for k, v in WORKOUT.items() if k != 'user_id'}
+
+def test_v1_documents_pass_through():
+    decoded = server.decode_workout(dict(WORKOUT))
+    assert decoded['exercises'] == WORKOUT['exercises']
+    assert 'user_id' not in decoded
+
+def test_fields_projection_decodes_v2_sets():
+    projection = server.workout_projection('exercises', None)
+    decoded = server.workout_decoder(projection)(project(server.encode_workout(WORKOUT), projection))
+    assert 'v' not in decoded
+    assert decoded['exercises'][0]['sets'] == WORKOUT['exercises'][0]['sets']
+    assert decoded['date'] == WORKOUT['date']
+    assert 'duration' not in decoded
+
+def test_only_bitmask_sized_exercises_are_encodable():
+    assert server.encodable(WORKOUT)
+    sets = [{'reps': 1, 'weight': 20.0}] * (server.MAX_SETS_PER_EXERCISE + 1)
+    assert not server.encodable({**WORKOUT, 'exercises': [{'name': 'Curl', 'category': 'Arms', 'sets': sets}]})
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+NOW = datetime(2025, 1, 6, 12, 0)
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs.sort(key=lambda d: d[field], reverse=direction < 0)
+        return self
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class Collection:
+    # Just the queries compute_sync and settled_seq make
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+
+    def find(self, query):
+        seqs = query['seq']
+        return Cursor([
+            dict(d) for d in self.docs
+            if d['user_id'] == query['user_id'] and seqs['$gt'] < d['seq'] <= seqs['$lte']
+        ])
+
+    async def find_one(self, query):
+        return next((d for d in self.docs if d['_id'] == query['_id']), None)
+
+
+class Db(dict):
+    __getattr__ = dict.__getitem__
+
+
+def workout(seq, day):
+    return {'_id': f'w{seq}', 'user_id': 'alice', 'date': day, 'exercises': [], 'seq': seq, 'updated_at': NOW}
+
+
+def steps(seq, day, count):
+    return {'user_id': 'alice', 'date': day, 'steps': count, 'seq': seq, 'updated_at': NOW}
+
+
+def tombstone(seq, collection, key):
+    return {'user_id': 'alice', 'collection': collection, 'key': key, 'seq': seq, 'deleted_at': NOW}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = Db(
+        workouts=Collection([workout(1, '2025-01-01'), workout(4, '2025-01-04'), {**workout(9, '2025-01-09'), 'user_id': 'bob'}]),
+        steps=Collection([steps(2, '2025-01-02', 800), steps(5, '2025-01-05', 900)]),
+        sync_tombstones=Collection([tombstone(3, 'workouts', 'w0')]),
+        counters=Collection([{'_id': 'alice:sync', 'seq': 5, 'pending': []}])
+    )
+    monkeypatch.setattr(server, 'db', db)
+    return db
+
+
+def sync(last_seq=0, limit=100):
+    return asyncio.run(server.compute_sync('alice', last_seq, limit))
+
+
+def test_token_round_trip():
+    token = server.encode_sync_token(42, 1736164800.7)
+    assert '=' not in token
+    assert server.decode_sync_token(token) == (42, 1736164800)
+
+
+@pytest.mark.parametrize('token', ['', 'not a token', server.encode_sync_token(1, 2)[:-2]])
+def test_malformed_tokens_are_rejected(token):
+    with pytest.raises(HTTPException) as raised:
+        server.decode_sync_token(token)
+    assert raised.value.status_code == 400
+
+
+def test_merges_collections_in_seq_order(db):
+    result = sync()
+    assert [w['_id'] for w in result['workouts']] == ['w1', 'w4']
+    assert [s['date'] for s in result['steps']] == ['2025-01-02', '2025-01-05']
+    assert result['deleted'] == {'workouts': ['w0'], 'steps': []}
+    assert result['has_more'] is False
+    assert server.decode_sync_token(result['next'])[0] == 5
+
+
+def test_limit_pages_across_collections(db):
+    first = sync(limit=3)
+    assert [w['_id'] for w in first['workouts']] == ['w1']
+    assert [s['date'] for s in first['steps']] == ['2025-01-02']
+    assert first['deleted']['workouts'] == ['w0']
+    assert first['has_more'] is True
+    # A partial page is dated by its last change, not by when it was served
+    seq, issued_at = server.decode_sync_token(first['next'])
+    assert seq == 3
+    assert issued_at == int(NOW.replace(tzinfo=server.timezone.utc).timestamp())
+
+    second = sync(last_seq=seq, limit=3)
+    assert [w['_id'] for w in second['workouts']] == ['w4']
+    assert [s['date'] for s in second['steps']] == ['2025-01-05']
+    assert second['has_more'] is False
+    assert server.decode_sync_token(second['next'])[0] == 5
+
+
+def test_stops_short_of_pending_writes(db):
+    db.counters.docs[0]['pending'] = [{'first': 4, 'at': datetime.utcnow()}]
+    result = sync()
+    assert [w['_id'] for w in result['workouts']] == ['w1']
+    assert server.decode_sync_token(result['next'])[0] == 3
+    # A writer that died holds nothing back once its lease expires
+    lease = timedelta(seconds=server.SYNC_PENDING_LEASE_SECONDS + 1)
+    db.counters.docs[0]['pending'] = [{'first': 4, 'at': datetime.utcnow() - lease}]
+    assert server.decode_sync_token(sync()['next'])[0] == 5
+
+
+def test_nothing_new_keeps_the_token_seq(db):
+    result = sync(last_seq=5)
+    assert result['workouts'] == result['steps'] == []
+    seq, issued_at = server.decode_sync_token(result['next'])
+    assert seq == 5
+    assert abs(issued_at - time.time()) < 5
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+class Store:
+    def __init__(self):
+        self.batches = []
+        self.down = False
+
+    async def write(self, batch):
+        if self.down:
+            raise ConnectionError('MongoDB is down')
+        self.batches.append(dict(batch))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_coalesces_writes_per_key_until_the_interval():
+    store = Store()
+
+    async def scenario():
+        buffer = server.WriteBehindBuffer(store.write, max_entries=10, interval=0.01)
+        for steps in (100, 200, 300):
+            await buffer.put(('alice', '2025-01-06'), steps)
+        await buffer.put(('bob', '2025-01-06'), 5)
+        assert store.batches == []
+        await asyncio.sleep(0.05)
+        return buffer
+
+    buffer = run(scenario())
+    assert store.batches == [{('alice', '2025-01-06'): 300, ('bob', '2025-01-06'): 5}]
+    assert buffer.metrics['writes'] == 4
+    assert buffer.metrics['flushes'] == 1
+
+
+def test_full_buffer_flushes_before_taking_a_new_key():
+    store = Store()
+
+    async def scenario():
+        buffer = server.WriteBehindBuffer(store.write, max_entries=3, interval=60)
+        for day in range(5):
+            await buffer.put(('alice', day), day)
+        await asyncio.sleep(0)
+        await buffer.close()
+
+    run(scenario())
+    flushed = {}
+    for batch in store.batches:
+        assert len(batch) <= 3
+        flushed.update(batch)
+    assert flushed == {('alice', day): day for day in range(5)}
+
+
+def test_memory_stays_bounded_while_the_store_is_down():
+    store = Store()
+    store.down = True
+
+    async def scenario():
+        buffer = server.WriteBehindBuffer(store.write, max_entries=3, interval=60)
+        rejected = 0
+        for day in range(10):
+            try:
+                await buffer.put(('alice', day), day)
+            except server.BufferFull:
+                rejected += 1
+            await asyncio.sleep(0)
+            assert buffer.size() <= 3
+        # Keys already buffered still take updates
+        await buffer.put(('alice', 0), 1000)
+        store.down = False
+        await buffer.close()
+        return buffer, rejected
+
+    buffer, rejected = run(scenario())
+    assert rejected == 7
+    assert buffer.metrics['rejected'] == 7
+    assert store.batches == [{('alice', 0): 1000, ('alice', 1): 1, ('alice', 2): 2}]
+
+
+def test_discard_drops_a_buffered_write():
+    store = Store()
+
+    async def scenario():
+        buffer = server.WriteBehindBuffer(store.write, max_entries=10, interval=60)
+        await buffer.put(('alice', '2025-01-06'), 10)
+        assert buffer.discard(('alice', '2025-01-06'))
+        assert not buffer.discard(('alice', '2025-01-06'))
+        await buffer.close()
+
+    run(scenario())
+    assert store.batches == []
+
+
+def test_close_raises_when_the_final_flush_fails():
+    store = Store()
+    store.down = True
+
+    async def scenario():
+        buffer = server.WriteBehindBuffer(store.write, max_entries=10, interval=60)
+        await buffer.put(('alice', '2025-01-06'), 10)
+        with pytest.raises(ConnectionError):
+            await buffer.close()
+        assert buffer.pending == {('alice', '2025-01-06'): 10}
+        buffer.timer.cancel()
+
+    run(scenario())